@@ -11,11 +11,12 @@ import pandas as pd
 import plotly.graph_objects as go
 import yaml
 from app import app
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 from dash_table import DataTable
 from logzero import logger
 
 sys.path.append("../source")
+import downsample
 import queries
 import plot_tools
 import ts_tools
@@ -75,6 +76,8 @@ layout_app1 = html.Div(
                             style={"display": "inline-block", "textAlign": "center"},
                         ),
                         dcc.Graph(id="graph-data-view"),
+                        # rendered widths of the line plots, in px
+                        dcc.Store(id="store-graph-width"),
                     ],
                     width={"size": 6},
                 ),
@@ -147,9 +150,8 @@ layout_app1 = html.Div(
 def get_zipcodes(file_name):
     logger.info(f"get_zipcodes callback: {file_name}")
 
-    conn = ts_tools.get_db_connection(db_path, file_name)
-    zipcodes = ts_tools.get_db_zipcodes(conn)
-    conn.close()
+    with ts_tools.db_connection(db_path, file_name) as conn:
+        zipcodes = ts_tools.get_db_zipcodes(conn)
 
     logger.info(f"app1 zipcodes retrieved\n{zipcodes}")
 
@@ -168,6 +170,39 @@ def get_zipcodes(file_name):
 #     logger.info(f"app1 zipcode selected: {options[0]['value']}")
 #     return options[0]["value"]
 
+# the browser reports each line plot's width after every relayout (first
+# draw, resize, zoom), the resolution and point count of the next draw follow it
+app.clientside_callback(
+    """
+    function(data_relayout, meteoro_relayout) {
+        const width = (id) => {
+            const el = document.getElementById(id);
+            return el ? el.clientWidth : null;
+        };
+        return {
+            "graph-data-view": width("graph-data-view"),
+            "graph-meteoro-view": width("graph-meteoro-view"),
+        };
+    }
+    """,
+    Output("store-graph-width", "data"),
+    Input("graph-data-view", "relayoutData"),
+    Input("graph-meteoro-view", "relayoutData"),
+)
+
+
+def get_min_points(graph_widths, graph_id):
+    return ts_tools.get_min_points((graph_widths or {}).get(graph_id))
+
+
+def get_max_points(graph_widths, graph_id):
+    return plot_tools.get_max_points((graph_widths or {}).get(graph_id))
+
+
+def get_title(title, resolution):
+    return title if resolution == "hourly" else f"{title} ({resolution} means)"
+
+
 # -------------------------------------------------------------------#
 @app.callback(
     # [
@@ -180,36 +215,81 @@ def get_zipcodes(file_name):
     # -------------------------------------
     Input("dd-db-selection", "value"),
     Input("dd-zipcode-selection", "value"),
+    Input("graph-data-view", "relayoutData"),
+    Input("graph-meteoro-view", "relayoutData"),
+    State("store-graph-width", "data"),
 )
-def graph_output(db_filename, zipcode):
+def graph_output(db_filename, zipcode, data_relayout, meteoro_relayout, graph_widths):
 
     cntx = dash.callback_context
     context = cntx.triggered[0]["prop_id"].split(".")[0]
     logger.info(f"app1 graph_output #1 Context = {context}\n")
     # print(f"app1 graph_output #1 Context: {context}")
 
+    # zoom / pan: redraw only the zoomed graph, reading just the visible
+    # window at the coarsest resolution that still fills the plot
+    if context in ("graph-data-view", "graph-meteoro-view"):
+        x_range = downsample.get_x_range(
+            data_relayout if context == "graph-data-view" else meteoro_relayout
+        )
+        if x_range is None or not zipcode:
+            raise dash.exceptions.PreventUpdate
+
+        with ts_tools.db_connection(db_path, db_filename) as conn:
+            locale_data = ts_tools.get_locale_data(conn, zipcode)
+            columns = (
+                cfg["irradiance_columns"] if context == "graph-data-view" else cfg["meteorological_fields"]
+            )
+            min_points = get_min_points(graph_widths, context)
+            df, resolution = ts_tools.get_irr_view(conn, zipcode, x_range, min_points, columns=columns)
+
+        if context == "graph-data-view":
+            fig = plot_tools.plot_irradiance(
+                df,
+                title=get_title("Irradiance Data", resolution),
+                zipcode=zipcode,
+                irr_columns=cfg["irradiance_columns"],
+                locale=locale_data,
+                max_points=get_max_points(graph_widths, context),
+                x_range=x_range,
+            )
+        else:
+            fig = plot_tools.plot_multi_line(
+                df,
+                title=get_title("Meteorological Conditions", resolution),
+                locale=locale_data,
+                columns=cfg["meteorological_fields"],
+                max_points=get_max_points(graph_widths, context),
+                x_range=x_range,
+            )
+        logger.info(f"app1 {context} zoomed to {x_range}")
+
+        outputs = [dash.no_update] * 6
+        outputs[0 if context == "graph-data-view" else 2] = fig
+        return tuple(outputs)
+
     if context == "dd-db-selection":
-        conn = ts_tools.get_db_connection(db_path, db_filename)
-        # zipcodes = ts_tools.get_db_zipcodes(conn)
-        # zipcode = zipcodes[0]
-        locale_data = ts_tools.get_locale_data(conn, zipcode)
-        df = ts_tools.get_irr_data(conn, zipcode)
+        with ts_tools.db_connection(db_path, db_filename) as conn:
+            # zipcodes = ts_tools.get_db_zipcodes(conn)
+            # zipcode = zipcodes[0]
+            locale_data = ts_tools.get_locale_data(conn, zipcode)
+            df = ts_tools.get_irr_data(conn, zipcode)
         logger.info(f"app1 Made if: {db_filename}, {zipcode}")
 
     elif context == "dd-zipcode-selection":
-        conn = ts_tools.get_db_connection(db_path, db_filename)
-        locale_data = ts_tools.get_locale_data(conn, zipcode)
-        df = ts_tools.get_irr_data(conn, zipcode)
+        with ts_tools.db_connection(db_path, db_filename) as conn:
+            locale_data = ts_tools.get_locale_data(conn, zipcode)
+            df = ts_tools.get_irr_data(conn, zipcode)
         logger.info(f"app1 Made elif: {db_filename}, {zipcode}")
 
     else:
         db_filename = cfg["file_names"]["default_db"]
-        conn = ts_tools.get_db_connection(db_path, db_filename)
-        zipcodes = ts_tools.get_db_zipcodes(conn)
-        if not zipcode:
-            zipcode = zipcodes[0]
-        locale_data = ts_tools.get_locale_data(conn, zipcode)
-        df = ts_tools.get_irr_data(conn, zipcode)
+        with ts_tools.db_connection(db_path, db_filename) as conn:
+            zipcodes = ts_tools.get_db_zipcodes(conn)
+            if not zipcode:
+                zipcode = zipcodes[0]
+            locale_data = ts_tools.get_locale_data(conn, zipcode)
+            df = ts_tools.get_irr_data(conn, zipcode)
         logger.info(f"app1 Made else: {db_filename}, {zipcode}")
 
     logger.info(f"app1 passed if/elif/else")
@@ -221,26 +301,51 @@ def graph_output(db_filename, zipcode):
 
     logger.info(f"app1 passed df_desc")
 
+    # the line plots read rollups when the whole series is shown
+    with ts_tools.db_connection(db_path, db_filename) as conn:
+        df_view, resolution = ts_tools.get_irr_view(
+            conn,
+            zipcode,
+            min_points=get_min_points(graph_widths, "graph-data-view"),
+            columns=cfg["irradiance_columns"] + cfg["meteorological_fields"],
+        )
+
     title1 = "Irradiance Data"
     fig1 = plot_tools.plot_irradiance(
-        df, title=title1, zipcode=zipcode, irr_columns=cfg["irradiance_columns"], locale=locale_data
+        df_view,
+        title=get_title(title1, resolution),
+        zipcode=zipcode,
+        irr_columns=cfg["irradiance_columns"],
+        locale=locale_data,
+        max_points=get_max_points(graph_widths, "graph-data-view"),
     )
     logger.info(f"app1 passed {title1}")
 
+    with ts_tools.db_connection(db_path, db_filename) as conn:
+        histograms = ts_tools.get_histograms(
+            conn,
+            zipcode,
+            df.columns.tolist(),
+            bins=cfg["histogram"]["bins"],
+            max_bins=cfg["histogram"]["max_bins"],
+        )
+
     title2 = "Data Distributions"
     fig2 = plot_tools.plot_histograms(
         df,
         title=title2,
         zipcode=zipcode,
+        histograms=histograms,
     )
     logger.info(f"app1 passed {title2}")
 
     title3 = "Meteorological Conditions"
     fig3 = plot_tools.plot_multi_line(
-        df,
-        title=title3,
+        df_view,
+        title=get_title(title3, resolution),
         locale=locale_data,
         columns=cfg["meteorological_fields"],
+        max_points=get_max_points(graph_widths, "graph-meteoro-view"),
     )
     logger.info(f"app1 passed {title3}")
 
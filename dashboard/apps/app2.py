@@ -81,9 +81,8 @@ layout_app2 = html.Div(
 def get_zipcodes(file_name):
     logger.info(f"get_zipcodes callback: {file_name}")
 
-    conn = ts_tools.get_db_connection(db_path, file_name)
-    zipcodes = ts_tools.get_db_zipcodes(conn)
-    conn.close()
+    with ts_tools.db_connection(db_path, file_name) as conn:
+        zipcodes = ts_tools.get_db_zipcodes(conn)
 
     logger.info(f"app2 zipcodes retrieved\n{zipcodes}")
 
@@ -116,38 +115,43 @@ def graph_output(db_filename, zipcode):
     logger.info(f"app2 graph_output #1 Context = {context}\n")
 
     if context == "app2-dd-db-selection":
-        conn = ts_tools.get_db_connection(db_path, db_filename)
-        # zipcodes = ts_tools.get_db_zipcodes(conn)
-        # zipcode = zipcodes[0]
-        locale_data = ts_tools.get_locale_data(conn, zipcode)
-        df = ts_tools.get_irr_data(conn, zipcode)
+        with ts_tools.db_connection(db_path, db_filename) as conn:
+            # zipcodes = ts_tools.get_db_zipcodes(conn)
+            # zipcode = zipcodes[0]
+            locale_data = ts_tools.get_locale_data(conn, zipcode)
+            df = ts_tools.get_irr_data(conn, zipcode, resolution="monthly")
         logger.info(f"app2 Made if: {db_filename}, {zipcode}")
 
     elif context == "app2-dd-zipcode-selection":
         # print(f"Made elif: {db_filename}, {zipcode}")
-        conn = ts_tools.get_db_connection(db_path, db_filename)
-        locale_data = ts_tools.get_locale_data(conn, zipcode)
-        df = ts_tools.get_irr_data(conn, zipcode)
+        with ts_tools.db_connection(db_path, db_filename) as conn:
+            locale_data = ts_tools.get_locale_data(conn, zipcode)
+            df = ts_tools.get_irr_data(conn, zipcode, resolution="monthly")
         logger.info(f"app2 Made elif: {db_filename}, {zipcode}")
 
     else:
         db_filename = cfg["file_names"]["default_db"]
-        conn = ts_tools.get_db_connection(db_path, db_filename)
-        zipcodes = ts_tools.get_db_zipcodes(conn)
-        if not zipcode:
-            zipcode = zipcodes[0]
-        locale_data = ts_tools.get_locale_data(conn, zipcode)
-        df = ts_tools.get_irr_data(conn, zipcode)
+        with ts_tools.db_connection(db_path, db_filename) as conn:
+            zipcodes = ts_tools.get_db_zipcodes(conn)
+            if not zipcode:
+                zipcode = zipcodes[0]
+            locale_data = ts_tools.get_locale_data(conn, zipcode)
+            df = ts_tools.get_irr_data(conn, zipcode, resolution="monthly")
         logger.info(f"app2 Made else: {db_filename}, {zipcode}")
 
     logger.info(f"app2 passed if/elif/else")
 
+    # hourly databases decompose their monthly rollup, nsrdb_monthly.db its own rows
+    with ts_tools.db_connection(db_path, db_filename) as conn:
+        decomps = ts_tools.get_zip_decomps(conn, zipcode, period=12, resolution="monthly")
+
     title1 = "Trend Data (decomposed)"
     fig1 = plot_tools.plot_trends(
         df,
         title=title1,
         zipcode=zipcode,
         locale=locale_data,
+        decomps=decomps,
     )
     logger.info(f"app2 passed {title1}")
 
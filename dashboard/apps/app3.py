@@ -1,6 +1,6 @@
 import sqlite3
 import sys
-import pickle
+import uuid
 
 import dash
 import dash_bootstrap_components as dbc
@@ -18,6 +18,8 @@ from dash_table import DataTable
 from logzero import logger
 
 sys.path.append("../source")
+import figure_cache as fc
+import forecast_jobs
 import plot_tools
 import pmd_tools
 import queries
@@ -37,6 +39,14 @@ db_path = cfg["file_paths"]["db_path"]
 db_files = ts_tools.get_db_files(db_path)
 logger.info(f"DB Path: {db_path}\n{db_files}\n")
 
+# one job queue per dashboard process, forecasts run outside the request threads
+jobs_cfg = dict(cfg["forecast_jobs"])
+poll_ms = jobs_cfg.pop("poll_ms")
+jobs = forecast_jobs.create_jobs(**jobs_cfg)
+
+# rendered forecasts per (session, db, zipcode, feature, model)
+figure_cache = fc.FigureCache(**cfg["figure_cache"])
+
 # --------------------------begin layout--------------------------#
 layout_app3 = html.Div(
     [
@@ -82,11 +92,32 @@ layout_app3 = html.Div(
                             color="success",
                             className="mr-1",
                         ),
+                        dbc.Button(
+                            "Cancel",
+                            id="app3-btn-cancel",
+                            color="danger",
+                            className="mr-1",
+                        ),
                     ],
-                    width={"size": 1, "offset": 2},
+                    width={"size": 2, "offset": 1},
                 ),
             ],
         ),
+        dbc.Row(
+            dbc.Col(
+                [
+                    dbc.Progress(id="app3-progress-job", value=0, striped=True, animated=True),
+                    html.Div(id="app3-job-status"),
+                    # job id of this browser session's forecast
+                    dcc.Store(id="app3-store-job", storage_type="session"),
+                    # job id whose figures are already in the figure cache
+                    dcc.Store(id="app3-store-rendered", storage_type="session"),
+                    dcc.Store(id="app3-store-session", storage_type="session"),
+                    dcc.Interval(id="app3-interval-job", interval=poll_ms, disabled=True),
+                ],
+                width={"size": 11},
+            ),
+        ),
         dbc.Row(
             dbc.Col(
                 [
@@ -139,9 +170,8 @@ def get_zipcodes(file_name):
     logger.info(f"get_zipcodes callback: {file_name}")
     # print(f"app3 get_zipcodes callback: {file_name}")
 
-    conn = ts_tools.get_db_connection(db_path, file_name)
-    zipcodes = ts_tools.get_db_zipcodes(conn)
-    conn.close()
+    with ts_tools.db_connection(db_path, file_name) as conn:
+        zipcodes = ts_tools.get_db_zipcodes(conn)
 
     logger.info(f"app3 zipcodes retrieved\n{zipcodes}")
     # print(f"app3 1st of zipcodes retrieved: {zipcodes[0]}")
@@ -181,8 +211,8 @@ def return_zipcode_value(zipcode):
     # logger.info(f"app3 zipcode selected: {options[0]['value']}")
     # print(f"app3 set_zipcode_value: {options[0]['value']}")
     db_filename = cfg["file_names"]["default_db"]
-    conn = ts_tools.get_db_connection(db_path, db_filename)
-    locale_data = ts_tools.get_locale_data(conn, zipcode)
+    with ts_tools.db_connection(db_path, db_filename) as conn:
+        locale_data = ts_tools.get_locale_data(conn, zipcode)
 
     return f"{locale_data[0]}, {locale_data[2]}"
 
@@ -195,9 +225,8 @@ def return_zipcode_value(zipcode):
 def get_features(file_name):
     logger.info(f"get_features callback")
 
-    conn = ts_tools.get_db_connection(db_path, file_name)
-    col_names = ts_tools.get_column_names(conn, cfg["table_names"]["db_table1"])
-    conn.close()
+    with ts_tools.db_connection(db_path, file_name) as conn:
+        col_names = ts_tools.get_column_names(conn, cfg["table_names"]["db_table1"])
 
     logger.info(f"app3 column names:\n{col_names}")
 
@@ -226,144 +255,170 @@ def get_features(file_name):
 
 # -------------------------------------------------------------------#
 @app.callback(
-    Output("app3-graph-arima-1", "figure"),
-    Output("app3-graph-arima-2", "figure"),
-    # Output("app3-dd-zipcode-selection-locale", "children"),
+    Output("app3-store-job", "data"),
     # -------------------------------------------
     Input("app3-btn-forecast", "n_clicks"),
+    Input("app3-btn-cancel", "n_clicks"),
     # -------------------------------------------
     State("app3-dd-db-selection", "value"),
     State("app3-dd-zipcode-selection", "value"),
     State("app3-dd-feature-selection", "value"),
     State("rb-seasonal-diff", "value"),
+    State("app3-store-job", "data"),
 )
-def graph_output(n_clicks, db_filename, zipcode, feature, seasonal):
+def submit_forecast(n_forecast, n_cancel, db_filename, zipcode, feature, seasonal, job_data):
 
     cntx = dash.callback_context
     context = cntx.triggered[0]["prop_id"].split(".")[0]
+    logger.info(f"submit_forecast context: {context}, job: {job_data}")
 
-    logger.info(f"graph_output entry context: {context}")
-    logger.info(f"graph_output arguments: {db_filename}, {zipcode}, {feature}")
-
-    # print(f"graph_output entry context: {context}")
-    # print(f"graph_output arguments: {db_filename}, {zipcode}, {feature}")
-
-    if context == "":
-        db_filename = cfg["file_names"]["default_db"]
-        conn = ts_tools.get_db_connection(db_path, db_filename)
-        zipcodes = ts_tools.get_db_zipcodes(conn)
-        if not zipcode:
-            zipcode = zipcodes[0]
-        locale_data = ts_tools.get_locale_data(conn, zipcode)
-        df = ts_tools.get_irr_data(conn, zipcode)
-
-        logger.info(f"app3 Made if: {db_filename}, {zipcode}, {locale_data}")
-        # print(f"Made if: {db_filename}, {zipcode}, {feature}")
-
-    elif context == "app3-btn-forecast":
-        conn = ts_tools.get_db_connection(db_path, db_filename)
-        # zipcodes = ts_tools.get_db_zipcodes(conn)
-        # zipcode = zipcodes[0]
-        locale_data = ts_tools.get_locale_data(conn, zipcode)
-        df = ts_tools.get_irr_data(conn, zipcode)
-
-        logger.info(f"app3 Made else: {db_filename}, {zipcode}, {locale_data}, {feature}")
-        # print(f"Made else: {db_filename}, {zipcode}, {locale_data}, {feature}")
+    if context not in ("app3-btn-forecast", "app3-btn-cancel"):
+        raise dash.exceptions.PreventUpdate
 
-    logger.info(f"app3 passed if/elif/else")
-    logger.info(f"{db_filename}, {zipcode}, {locale_data}, {feature}")
-    # print(f"ready for forecast: {db_filename}, {zipcode}, {locale_data}, {feature}")
+    # a new forecast replaces this session's previous one
+    if job_data and job_data.get("job_id"):
+        jobs.cancel(job_data["job_id"])
 
-    if context == "app3-btn-forecast":
-        test_len_yrs = 5
-        test_periods = 5 * 12
-        fc_periods = 5 * 12
+    if context == "app3-btn-cancel":
+        return {"job_id": None, "message": "forecast cancelled"}
 
-        dt_idx = pd.date_range("2021-01-01", periods=fc_periods, freq="M")
+    if not (db_filename and zipcode and feature):
+        return {"job_id": None, "message": "select a database, zip code and feature"}
 
-        logger.info(f"app3 parameters: {test_len_yrs}, {test_periods}, {fc_periods}, {feature}")
-        logger.info(f"forecast datetime index: {dt_idx}")
+    params = {
+        "db_filename": db_filename,
+        "zipcode": zipcode,
+        "feature": feature,
+        "models": ["fft", "seasonal"] if seasonal else ["fft"],
+        "test_periods": 5 * 12,
+        "fc_periods": 5 * 12,
+        "model_store": cfg["model_store"],
+    }
 
-        train, test = pm.model_selection.train_test_split(df, test_size=test_periods)
-        logger.info(train.tail(5))
-        logger.info(test.head(5))
+    # read here, through the storage backends and caches, the job process
+    # only fits
+    with ts_tools.db_connection(db_path, db_filename) as conn:
+        df = ts_tools.get_irr_data(conn, zipcode, columns=[feature])
 
-        fft_model = pmd_tools.get_arima_fft_model(train[feature], fc_periods)
-        logger.info(fft_model)
+    try:
+        job_id = jobs.submit(params, df)
+    except forecast_jobs.JobLimitError as err:
+        logger.warning(f"app3 forecast rejected: {err}")
+        return {"job_id": None, "message": "the forecast queue is full, try again shortly"}
 
-        fft_test_pred = fft_model.predict(n_periods=fc_periods, return_conf_int=False)
-        fft_test_pred = pd.Series(fft_test_pred, index=test.index)
+    return {"job_id": job_id, "params": params}
 
-        fft_model.update(test[feature])
 
-        fft_forecast = fft_model.predict(n_periods=fc_periods, return_conf_int=False)
-        fft_forecast = pd.Series(fft_forecast, index=dt_idx)
+# -------------------------------------------------------------------#
+@app.callback(
+    Output("app3-store-session", "data"),
+    Input("app3-store-session", "modified_timestamp"),
+    State("app3-store-session", "data"),
+)
+def set_session(timestamp, session_data):
+    # one id per browser session, keys this session's cached figures
+    if session_data and session_data.get("session_id"):
+        raise dash.exceptions.PreventUpdate
+    return {"session_id": uuid.uuid4().hex}
 
-        title1 = f"{feature}, FFT,"
-        fig1 = plot_tools.plot_forecast(
-            train[feature],
-            test[feature],
-            fft_test_pred,
-            fft_forecast,
-            title=title1,
-            zipcode=zipcode,
-            locale=locale_data,
-        )
 
-        with open("logs/fc_fig1.pickle", "wb") as fh:
-            pickle.dump(fig1, fh, protocol=pickle.HIGHEST_PROTOCOL)
+# -------------------------------------------------------------------#
+# forecast title per model, in graph order, see pmd_tools.arima_models
+model_titles = {"fft": "FFT", "seasonal": "Seasonal Diff"}
 
-        logger.info(f"app3 FFT finished {title1}")
 
-        print(f"seasonal: {seasonal}")
-        if seasonal:
-            auto_model = pmd_tools.get_arima_auto_model(train[feature], fc_periods)
-            logger.info(auto_model)
+def get_figure_key(session_data, db_filename, zipcode, feature, model_name):
+    """cache key of one figure, None until set_session has assigned the session id"""
+    session_id = session_data.get("session_id") if session_data else None
+    if session_id is None:
+        return None
+    return (session_id, db_filename, zipcode, feature, model_name)
 
-            auto_test_pred = auto_model.predict(n_periods=fc_periods, return_conf_int=False)
-            auto_test_pred = pd.Series(auto_test_pred, index=test.index)
 
-            auto_model.update(test[feature])
+def cache_forecast_figures(session_data, params, result):
+    """render a finished job's figures into the figure cache"""
+    zipcode = params["zipcode"]
+    feature = params["feature"]
 
-            auto_forecast = auto_model.predict(n_periods=fc_periods, return_conf_int=False)
-            auto_forecast = pd.Series(auto_forecast, index=dt_idx)
+    with ts_tools.db_connection(db_path, params["db_filename"]) as conn:
+        locale_data = ts_tools.get_locale_data(conn, zipcode)
 
-            title2 = f"{feature}, Seasonal Diff,"
-            fig2 = plot_tools.plot_forecast(
-                train[feature],
-                test[feature],
-                auto_test_pred,
-                auto_forecast,
-                title=title2,
+    for model_name in model_titles:
+        # a model this run skipped must not keep showing an earlier run's figure
+        forecast = result.get(model_name)
+        if forecast is None:
+            fig = go.Figure()
+        else:
+            fig = plot_tools.plot_forecast(
+                forecast["train"],
+                forecast["test"],
+                forecast["test_pred"],
+                forecast["forecast"],
+                title=f"{feature}, {model_titles[model_name]},",
                 zipcode=zipcode,
                 locale=locale_data,
             )
+        key = get_figure_key(session_data, params["db_filename"], zipcode, feature, model_name)
+        figure_cache.put(key, fig)
 
-            with open("logs/fc_fig2.pickle", "wb") as fh:
-                pickle.dump(fig2, fh, protocol=pickle.HIGHEST_PROTOCOL)
-
-            logger.info(f"app3 seasonal finished {title1}")
-
-        else:
-            fig2 = go.Figure()
-            logger.info(f"app3 seasonal skipped")
-
-        return fig1, fig2
 
-    try:
-        with open("logs/fc_fig1.pickle", "rb") as fh:
-            fig1 = pickle.load(fh)
-    except:
-        fig1 = go.Figure()
-
-    try:
-        with open("logs/fc_fig2.pickle", "rb") as fh:
-            fig2 = pickle.load(fh)
-    except:
-        fig2 = go.Figure()
-
-    return (
-        fig1,
-        fig2,
-        # f"{locale_data[0]}, {locale_data[2]}",
-    )
+@app.callback(
+    Output("app3-graph-arima-1", "figure"),
+    Output("app3-graph-arima-2", "figure"),
+    Output("app3-progress-job", "value"),
+    Output("app3-job-status", "children"),
+    Output("app3-interval-job", "disabled"),
+    Output("app3-store-rendered", "data"),
+    # -------------------------------------------
+    Input("app3-interval-job", "n_intervals"),
+    Input("app3-store-job", "data"),
+    Input("app3-store-session", "data"),
+    Input("app3-dd-db-selection", "value"),
+    Input("app3-dd-zipcode-selection", "value"),
+    Input("app3-dd-feature-selection", "value"),
+    # -------------------------------------------
+    State("app3-store-rendered", "data"),
+)
+def poll_forecast(n_intervals, job_data, session_data, db_filename, zipcode, feature, rendered_job_id):
+
+    job_id = job_data.get("job_id") if job_data else None
+    status = jobs.status(job_id) if job_id else None
+
+    if status is None:
+        message = job_data.get("message", "") if job_data else ""
+        progress = 0
+    elif status["state"] == "queued":
+        message = f"queued, position {status['position']}"
+        return dash.no_update, dash.no_update, 0, message, False, dash.no_update
+    elif status["state"] == "running":
+        return dash.no_update, dash.no_update, status["progress"], status["message"], False, dash.no_update
+    elif status["state"] == "done":
+        params = job_data["params"]
+        key = get_figure_key(session_data, params["db_filename"], params["zipcode"], params["feature"], "fft")
+        if key is None:
+            # nothing is cached under a key every session would share; the
+            # session store update re-runs this callback
+            return dash.no_update, dash.no_update, 100, "forecast finished", True, dash.no_update
+        # every finished job replaces the figures of earlier runs, once
+        if rendered_job_id != job_id:
+            cache_forecast_figures(session_data, params, status["result"])
+            rendered_job_id = job_id
+            logger.info(f"app3 forecast job {job_id} cached: {params['feature']}, {params['zipcode']}")
+
+        model_status = ", ".join(
+            f"{name} {result['model_status']}" for name, result in status["result"].items()
+        )
+        message = f"forecast finished ({model_status})"
+        progress = 100
+    else:
+        message = f"forecast {status['state']}: {status['message']}"
+        progress = 0
+
+    # this session's forecasts for the current selection, if any
+    figs = []
+    for model_name in model_titles:
+        key = get_figure_key(session_data, db_filename, zipcode, feature, model_name)
+        fig = figure_cache.get(key) if key is not None else None
+        figs.append(fig if fig is not None else go.Figure())
+
+    return figs[0], figs[1], progress, message, True, rendered_job_id
@@ -0,0 +1,231 @@
+import sys
+
+import dash
+import dash_bootstrap_components as dbc
+import dash_core_components as dcc
+import dash_html_components as html
+import logzero
+import numpy as np
+import pandas as pd
+import yaml
+from app import app
+from dash.dependencies import Input, Output, State
+from dash_table import DataTable
+from logzero import logger
+
+sys.path.append("../source")
+import plot_tools
+import queries
+import ts_tools
+
+
+# open and retrieve configuration data
+try:
+    with open("../source/config.yml", "r") as config_in:
+        cfg = yaml.load(config_in, Loader=yaml.SafeLoader)
+        logger.info(f"{cfg}\n")
+except:
+    logger.error(f"config file open failure.")
+    exit(1)
+
+db_path = cfg["file_paths"]["db_path"]
+db_files = ts_tools.get_db_files(db_path)
+logger.info(f"DB Path: {db_path}\n{db_files}\n")
+
+# zip codes preselected when a database is chosen
+default_zip_count = 10
+
+
+# --------------------------begin layout--------------------------#
+layout_app4 = html.Div(
+    [
+        dbc.Row(
+            [
+                dbc.Col(
+                    dcc.Dropdown(
+                        id="app4-dd-db-selection",
+                        options=[{"label": db, "value": db} for db in db_files],
+                        value=cfg["file_names"]["default_db"],
+                        placeholder="Select a database",
+                        persistence=True,
+                        persistence_type="session",
+                    ),
+                    width={"size": 2, "offset": 0},
+                ),
+                dbc.Col(
+                    dcc.Dropdown(
+                        id="app4-dd-feature-selection",
+                        options=[
+                            {"label": col.replace("_", " "), "value": col} for col in queries.nsr_row_columns
+                        ],
+                        value="GHI",
+                        clearable=False,
+                        persistence=True,
+                    ),
+                    width={"size": 2, "offset": 0},
+                ),
+                dbc.Col(
+                    dcc.Dropdown(
+                        id="app4-dd-resolution-selection",
+                        options=[{"label": name, "value": name} for name in ts_tools.resolutions],
+                        value="monthly",
+                        clearable=False,
+                        persistence=True,
+                    ),
+                    width={"size": 1, "offset": 0},
+                ),
+                dbc.Col(
+                    dcc.Dropdown(
+                        id="app4-dd-zipcode-selection",
+                        placeholder="Select Zip Codes",
+                        multi=True,
+                    ),
+                    width={"size": 7, "offset": 0},
+                ),
+            ],
+        ),
+        dbc.Row(
+            dbc.Col(
+                [
+                    dcc.Graph(id="app4-graph-lines"),
+                    # rendered widths of the plots, in px
+                    dcc.Store(id="app4-store-graph-width"),
+                ],
+                width={"size": 11, "offset": 0},
+            )
+        ),
+        dbc.Row(
+            [
+                dbc.Col(
+                    dcc.Graph(id="app4-graph-heatmap"),
+                    width={"size": 7, "offset": 0},
+                ),
+                dbc.Col(
+                    [
+                        html.H6(
+                            "Location Summary",
+                            style={"display": "inline-block", "textAlign": "center"},
+                        ),
+                        DataTable(
+                            id="app4-table-summary",
+                            sort_action="native",
+                            style_table={
+                                "height": "450px",
+                                "overflowY": "auto",
+                            },
+                            style_cell={
+                                "backgroundColor": "black",
+                                "forgroundColor": "white",
+                            },
+                            style_header={
+                                "backgroundColor": "black",
+                                "forgroundColor": "white",
+                                "fontWeight": "bold",
+                                "fontColor": "gold",
+                            },
+                        ),
+                    ],
+                    width={"size": 4, "offset": 0},
+                ),
+            ]
+        ),
+    ]
+)
+
+
+# --------------------------begin callbacks--------------------------#
+@app.callback(
+    Output("app4-dd-zipcode-selection", "options"),
+    Output("app4-dd-zipcode-selection", "value"),
+    Input("app4-dd-db-selection", "value"),
+)
+def get_zipcodes(file_name):
+    logger.info(f"app4 get_zipcodes callback: {file_name}")
+
+    with ts_tools.db_connection(db_path, file_name) as conn:
+        zipcodes = ts_tools.get_db_zipcodes(conn)
+        locales = ts_tools.get_multi_locale_data(conn, zipcodes)
+
+    labels = plot_tools.get_compare_labels(zipcodes, locales)
+    options = [{"label": label, "value": zipcode} for zipcode, label in zip(zipcodes, labels)]
+
+    return options, zipcodes[:default_zip_count]
+
+
+# the browser reports each plot's width after every relayout (first draw,
+# resize, zoom), the point count of the next draw follows it
+app.clientside_callback(
+    """
+    function(lines_relayout, heatmap_relayout) {
+        const width = (id) => {
+            const el = document.getElementById(id);
+            return el ? el.clientWidth : null;
+        };
+        return {
+            "app4-graph-lines": width("app4-graph-lines"),
+            "app4-graph-heatmap": width("app4-graph-heatmap"),
+        };
+    }
+    """,
+    Output("app4-store-graph-width", "data"),
+    Input("app4-graph-lines", "relayoutData"),
+    Input("app4-graph-heatmap", "relayoutData"),
+)
+
+
+# -------------------------------------------------------------------#
+@app.callback(
+    Output("app4-graph-lines", "figure"),
+    Output("app4-graph-heatmap", "figure"),
+    Output("app4-table-summary", "data"),
+    Output("app4-table-summary", "columns"),
+    Input("app4-dd-db-selection", "value"),
+    Input("app4-dd-zipcode-selection", "value"),
+    Input("app4-dd-feature-selection", "value"),
+    Input("app4-dd-resolution-selection", "value"),
+    State("app4-store-graph-width", "data"),
+)
+def graph_output(db_filename, zipcodes, feature, resolution, graph_widths):
+    if not db_filename or not zipcodes:
+        raise dash.exceptions.PreventUpdate
+
+    # one query for every selected zip code
+    with ts_tools.db_connection(db_path, db_filename) as conn:
+        df, resolution = ts_tools.get_multi_zip_data(conn, zipcodes, feature, resolution=resolution)
+        locales = ts_tools.get_multi_locale_data(conn, zipcodes)
+    logger.info(f"app4 {db_filename}: {feature} ({resolution}) for {len(zipcodes)} zip codes, {df.shape}")
+    if df.empty:
+        raise dash.exceptions.PreventUpdate
+
+    title = f"Location Comparison ({resolution})"
+    graph_widths = graph_widths or {}
+    fig1 = plot_tools.plot_compare_lines(
+        df,
+        title=title,
+        feature=feature,
+        locales=locales,
+        max_points=plot_tools.get_max_points(graph_widths.get("app4-graph-lines")),
+    )
+    fig2 = plot_tools.plot_compare_heatmap(
+        df,
+        title=title,
+        feature=feature,
+        locales=locales,
+        max_points=plot_tools.get_max_points(graph_widths.get("app4-graph-heatmap")),
+    )
+
+    values = df.to_numpy()
+    df_summary = pd.DataFrame(
+        {
+            "zipcode": df.columns,
+            "location": [f"{locales[z][0]}, {locales[z][2]}" if z in locales else "" for z in df.columns],
+            "mean": np.nanmean(values, axis=0),
+            "min": np.nanmin(values, axis=0),
+            "max": np.nanmax(values, axis=0),
+            "std": np.nanstd(values, axis=0),
+            "rows": np.count_nonzero(~np.isnan(values), axis=0),
+        }
+    ).round(decimals=2)
+    summary_columns = [{"id": col, "name": col} for col in df_summary.columns]
+
+    return fig1, fig2, df_summary.to_dict("records"), summary_columns
@@ -1,15 +1,21 @@
+import sys
+
 import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
+import flask
 import logzero
 
 from app import app
-from apps import app1, app2, app3, blog
+from apps import app1, app2, app3, app4, blog
 from dash.dependencies import Input, Output
 from dash_table import DataTable
 from logzero import logger
 
+sys.path.append("../source")
+import ts_tools
+
 # Connect to logzero log file
 log_path = "logs/"
 log_file = "dashboard_app.log"
@@ -67,6 +73,11 @@ app.layout = html.Div(
                                     href="/apps/app3",
                                     active="exact",
                                 ),
+                                dbc.NavLink(
+                                    "Compare",
+                                    href="/apps/app4",
+                                    active="exact",
+                                ),
                             ],
                             vertical=True,
                             pills=True,
@@ -105,6 +116,8 @@ def display_page(pathname):
         return app2.layout_app2
     elif pathname == "/apps/app3":
         return app3.layout_app3
+    elif pathname == "/apps/app4":
+        return app4.layout_app4
     else:
         return dbc.Jumbotron(
             [
@@ -115,6 +128,12 @@ def display_page(pathname):
         )
 
 
+@app.server.route("/stats")
+def cache_stats():
+    """result cache hit/miss and connection pool counters as JSON"""
+    return flask.jsonify(ts_tools.get_cache_stats())
+
+
 if __name__ == "__main__":
     app.run_server(
         # host="your-local-ip-here"
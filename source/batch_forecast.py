@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# fit the Forecasting page models for every zip code x feature of a monthly
+# database in a process pool; forecasts go to the forecasts table and fit
+# diagnostics to forecast_runs, where finished runs are skipped on restart
+#
+# usage:
+#   python batch_forecast.py ../data/db/nsrdb_monthly.db --workers 8
+#   python batch_forecast.py ../data/db/nsrdb_monthly.db --features GHI DNI --models fft
+#   python batch_forecast.py ../data/db/nsrdb_monthly.db --rerun   # ignore finished runs
+#   python batch_forecast.py ../data/db/nsrdb_monthly.db --npy-cache ../data/npy_cache/
+
+import argparse
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+from urllib.parse import quote
+
+import logzero
+import numpy as np
+import pandas as pd
+import yaml
+from logzero import logger
+from tqdm import tqdm
+from yaml import load
+
+sys.path.append("../source")
+import bulk_loader
+import npy_cache
+import pmd_tools
+import queries
+
+
+# the worker process's npy cache (--npy-cache), opened once by init_worker
+npy_store = None
+
+
+def init_worker(npy_path=None):
+    """pool initializer: one NpyCache per worker, its open maps reused across tasks"""
+    global npy_store
+    npy_store = npy_cache.NpyCache(npy_path) if npy_path else None
+
+
+def get_zip_data(db_file, zipcode):
+    """
+    monthly frame of one zip code, read-only so the writer is never blocked for long;
+    with --npy-cache every feature / model task of a zip code shares one memory-mapped copy
+    """
+    conn = sqlite3.connect(f"file:{quote(db_file)}?mode=ro", uri=True, timeout=60)
+    if npy_store is not None:
+        df = npy_store.read_irr_data(conn, zipcode)
+        if df is not None:
+            conn.close()
+            return df
+
+    df = pd.read_sql(
+        queries.select_nsr_rows,
+        conn,
+        params={"zipcode": zipcode},
+        index_col="date_time",
+        parse_dates=["date_time"],
+    )
+    conn.close()
+    return df.sort_index()
+
+
+def fit_task(db_file, zipcode, feature, model_name, test_periods, fc_periods):
+    """
+    worker process: fit one zip code / feature / model
+    return: (task, diagnostics dict, forecasts DataFrame) or (task, error text, None)
+    """
+    task = (zipcode, feature, model_name)
+    start = perf_counter()
+    try:
+        df = get_zip_data(db_file, zipcode)
+        result = pmd_tools.forecast_feature(
+            df, feature, model_name, test_periods=test_periods, fc_periods=fc_periods
+        )
+    except Exception as err:
+        return task, f"{type(err).__name__}: {err}", None
+
+    diagnostics = dict(result["diagnostics"])
+    diagnostics["rmse"] = float(np.sqrt(np.mean((result["test_pred"] - result["test"]) ** 2)))
+    diagnostics["n_obs"] = len(result["train"])
+    diagnostics["fit_seconds"] = perf_counter() - start
+
+    frames = []
+    for kind in ("test_pred", "forecast"):
+        series = result[kind]
+        frames.append(
+            pd.DataFrame(
+                {
+                    "zipcode": zipcode,
+                    "feature": feature,
+                    "model": model_name,
+                    "kind": kind,
+                    "date_time": series.index,
+                    "value": series.to_numpy(),
+                }
+            )
+        )
+
+    return task, diagnostics, pd.concat(frames, ignore_index=True)
+
+
+def get_run_params(task, status, diagnostics=None, error=None):
+    diagnostics = diagnostics or {}
+    return {
+        "zipcode": task[0],
+        "feature": task[1],
+        "model": task[2],
+        "status": status,
+        "arima_order": diagnostics.get("order"),
+        "seasonal_order": diagnostics.get("seasonal_order"),
+        "aic": diagnostics.get("aic"),
+        "bic": diagnostics.get("bic"),
+        "rmse": diagnostics.get("rmse"),
+        "n_obs": diagnostics.get("n_obs"),
+        "fit_seconds": diagnostics.get("fit_seconds"),
+        "error": error,
+    }
+
+
+def get_tasks(conn, zipcodes, features, models, rerun=False):
+    """every zipcode x feature x model not yet finished (all of them with rerun)"""
+    cursor = conn.cursor()
+    cursor.execute(queries.select_forecast_runs_done)
+    done = set() if rerun else set(cursor.fetchall())
+
+    return [
+        (zipcode, feature, model_name)
+        for zipcode in zipcodes
+        for feature in features
+        for model_name in models
+        if (zipcode, feature, model_name) not in done
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="batch ARIMA forecasts for every zip code and feature")
+    parser.add_argument("db_file", help="monthly nsrdb database")
+    parser.add_argument("--features", nargs="+", default=queries.nsr_row_columns)
+    parser.add_argument(
+        "--models", nargs="+", default=list(pmd_tools.arima_models), choices=list(pmd_tools.arima_models)
+    )
+    parser.add_argument("--zipcodes", nargs="+", help="default: every zip code in the database")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--test-periods", type=int, default=5 * 12)
+    parser.add_argument("--fc-periods", type=int, default=5 * 12)
+    parser.add_argument("--rerun", action="store_true", help="refit runs already marked done")
+    parser.add_argument("--npy-cache", help="memory-mapped zip code cache directory, see npy_cache.py")
+    args = parser.parse_args()
+
+    log_path = "logs/"
+    log_file = "batch_forecast.log"
+    logzero.logfile(log_path + log_file, maxBytes=1e5, backupCount=5, disableStderrLogger=True)
+
+    conn = sqlite3.connect(args.db_file, timeout=60)
+    cursor = conn.cursor()
+    cursor.execute(queries.create_table_forecast_runs)
+    cursor.execute(queries.create_table_forecasts)
+    conn.commit()
+
+    zipcodes = args.zipcodes
+    if not zipcodes:
+        cursor.execute(queries.select_distinct_zips)
+        zipcodes = sorted(row[0] for row in cursor.fetchall())
+
+    tasks = get_tasks(conn, zipcodes, args.features, args.models, rerun=args.rerun)
+    total = len(zipcodes) * len(args.features) * len(args.models)
+    print(f"{args.db_file}: {len(tasks)} of {total} fits to run on {args.workers} workers")
+    logger.info(f"{len(tasks)} tasks: {args}")
+
+    done = 0
+    failed = 0
+    fit_seconds = 0.0
+    start = perf_counter()
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=init_worker, initargs=(args.npy_cache,)
+    ) as executor:
+        futures = {
+            executor.submit(fit_task, args.db_file, *task, args.test_periods, args.fc_periods): task
+            for task in tasks
+        }
+
+        # results are written here, in the parent, as they arrive
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                task, diagnostics, df_forecasts = future.result()
+            except Exception as err:
+                # e.g. BrokenProcessPool when a worker is killed mid-fit;
+                # recorded as failed, the next run retries it
+                task, diagnostics, df_forecasts = futures[future], f"{type(err).__name__}: {err}", None
+            params = dict(zip(("zipcode", "feature", "model"), task))
+
+            if df_forecasts is None:
+                failed += 1
+                cursor.execute(queries.upsert_forecast_run, get_run_params(task, "failed", error=diagnostics))
+                conn.commit()
+                logger.error(f"{task} failed: {diagnostics}")
+                continue
+
+            bulk_loader.bulk_insert(
+                conn, "forecasts", df_forecasts, pre_statements=[(queries.delete_forecasts, params)]
+            )
+            cursor.execute(queries.upsert_forecast_run, get_run_params(task, "done", diagnostics))
+            conn.commit()
+
+            done += 1
+            fit_seconds += diagnostics["fit_seconds"]
+            logger.info(f"{task} done: {diagnostics}")
+
+    conn.close()
+
+    elapsed = perf_counter() - start
+    print(
+        f"fits done: {done}, failed: {failed}, elapsed: {elapsed:0.1f}s, "
+        + f"throughput: {60 * (done + failed) / max(elapsed, 1e-9):0.1f} fits/min, "
+        + f"parallel speed-up: {fit_seconds / max(elapsed, 1e-9):0.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
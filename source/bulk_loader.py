@@ -0,0 +1,166 @@
+# bulk writes of nsrdb frames into SQLite: one prepared executemany per
+# frame inside a single transaction, with load-time PRAGMAs and deferred
+# index builds; works for the hourly (create_table_nsrdb) and monthly
+# (create_table_monthly_nsrdb) schemas in ./queries.py
+
+from contextlib import contextmanager
+from time import perf_counter
+
+from logzero import logger
+
+import nsrdb_dtypes
+import queries
+
+
+time_format = "%Y-%m-%d %H:%M:%S"
+
+
+def get_table_columns(conn, table_name):
+    cursor = conn.cursor()
+    cursor.execute(queries.select_column_names, {"table_name": table_name})
+    return [row[0] for row in cursor.fetchall()]
+
+
+def get_insert_sql(table_name, columns):
+    names = ", ".join(f'"{col}"' for col in columns)
+    marks = ", ".join("?" for _ in columns)
+    return f'insert into "{table_name}" ({names}) values ({marks});'
+
+
+def get_records(df, columns):
+    """
+    row tuples of python scalars; datetimes as text, NaN/NaT bind as NULL,
+    float32 nsrdb measures (nsrdb_dtypes.is_measure) rounded back to their
+    published decimals
+    """
+    arrays = []
+    for col in columns:
+        series = df[col]
+        if series.dtype.kind == "M":
+            series = series.dt.strftime(time_format)
+        elif series.dtype == "float32" and nsrdb_dtypes.is_measure(col):
+            series = nsrdb_dtypes.to_float64(series.to_numpy(), nsrdb_dtypes.get_decimals(col))
+        arrays.append(series.tolist())
+
+    return zip(*arrays)
+
+
+def bulk_insert(conn, table_name, df, pre_statements=()):
+    """
+    input: sqlite3 connection, destination table name, DataFrame
+           optional (sql, params) statements run first in the same transaction
+    functionality: insert every row with one prepared executemany inside a
+                   single transaction; frame columns must exist in the table
+    return: dict of rows, seconds and rows/sec
+    """
+    # SQLite column names are case-insensitive (Year -> year)
+    table_columns = [col.lower() for col in get_table_columns(conn, table_name)]
+    unknown = [col for col in df.columns if col.lower() not in table_columns]
+    if unknown:
+        raise ValueError(f"columns not in {table_name}: {unknown}")
+
+    columns = df.columns.tolist()
+    insert_sql = get_insert_sql(table_name, columns)
+
+    start = perf_counter()
+    cursor = conn.cursor()
+    try:
+        if not conn.in_transaction:
+            cursor.execute("begin;")
+        for sql, params in pre_statements:
+            cursor.execute(sql, params)
+        cursor.executemany(insert_sql, get_records(df, columns))
+        conn.commit()
+    except:
+        # any failure, KeyboardInterrupt included, must not leave the
+        # transaction open for the caller's next commit
+        conn.rollback()
+        raise
+
+    seconds = perf_counter() - start
+    stats = {"rows": len(df), "seconds": seconds, "rows_per_sec": len(df) / max(seconds, 1e-9)}
+    logger.info(f"bulk insert {table_name}: {stats['rows']} rows, {stats['rows_per_sec']:,.0f} rows/s")
+
+    return stats
+
+
+def drop_indexes(conn, table_name):
+    """drop the table's explicit indexes, returning their create statements"""
+    cursor = conn.cursor()
+    cursor.execute(queries.select_table_indexes, {"table_name": table_name})
+    indexes = cursor.fetchall()
+
+    for name, _ in indexes:
+        cursor.execute(f'drop index if exists "{name}";')
+    conn.commit()
+
+    return [sql for _, sql in indexes]
+
+
+def is_empty(conn, table_name):
+    cursor = conn.cursor()
+    cursor.execute(f'select exists (select 1 from "{table_name}");')
+    return not cursor.fetchone()[0]
+
+
+def create_indexes(conn, index_sql):
+    cursor = conn.cursor()
+    for sql in index_sql:
+        cursor.execute(sql)
+    conn.commit()
+
+
+@contextmanager
+def load_session(conn, wal=False, synchronous_off=True, defer_indexes_on=()):
+    """
+    input: sqlite3 connection
+           Boolean: switch the database to WAL journaling (persistent)
+           Boolean: PRAGMA synchronous=OFF for the duration of the load
+           table names whose indexes are dropped now and rebuilt on exit,
+           only while a table is still empty (initial load)
+    functionality: tune the connection for bulk loads, restoring on exit;
+                   incremental loads keep their indexes, the per zip-year
+                   deletes need them and a killed run must not lose them
+    yield: running totals dict updated by add_stats()
+    """
+    if conn.in_transaction:
+        conn.commit()
+
+    cursor = conn.cursor()
+    if wal:
+        cursor.execute("PRAGMA journal_mode=WAL;")
+
+    cursor.execute("PRAGMA synchronous;")
+    synchronous = cursor.fetchone()[0]
+    if synchronous_off:
+        cursor.execute("PRAGMA synchronous=OFF;")
+
+    deferred = []
+    for table_name in defer_indexes_on:
+        if is_empty(conn, table_name):
+            deferred.extend(drop_indexes(conn, table_name))
+        else:
+            logger.info(f"{table_name} has rows, indexes kept")
+    logger.info(f"load session: wal={wal}, synchronous_off={synchronous_off}, deferred indexes={len(deferred)}")
+
+    totals = {"rows": 0, "seconds": 0.0}
+    start = perf_counter()
+    try:
+        yield totals
+    finally:
+        if conn.in_transaction:
+            conn.commit()
+        create_indexes(conn, deferred)
+        cursor.execute(f"PRAGMA synchronous={synchronous};")
+
+        elapsed = perf_counter() - start
+        logger.info(
+            f"load session finished: {totals['rows']} rows, "
+            + f"{totals['rows'] / max(totals['seconds'], 1e-9):,.0f} rows/s insert, "
+            + f"{elapsed:0.1f}s elapsed incl. index builds"
+        )
+
+
+def add_stats(totals, stats):
+    totals["rows"] += stats["rows"]
+    totals["seconds"] += stats["seconds"]
@@ -0,0 +1,155 @@
+# memory-bounded LRU cache for dashboard query results, keyed by the
+# database file and its modification time so a changed database is
+# never served stale; see ts_tools for the cached functions
+
+import copy
+import functools
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from logzero import logger
+
+
+def get_db_signature(conn):
+    """(file, mtime_ns, size) of the connection's main database and its WAL"""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA database_list;")
+    db_file = {row[1]: row[2] for row in cursor.fetchall()}["main"]
+
+    signature = [db_file]
+    for path in (db_file, db_file + "-wal"):
+        try:
+            stat = os.stat(path)
+            signature.extend([stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            signature.extend([None, None])
+
+    return tuple(signature)
+
+
+def get_size(value, depth=3):
+    """approximate bytes held by a cached value"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if depth == 0:
+        return sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(get_size(item, depth - 1) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(get_size(item, depth - 1) for item in value.values())
+    if hasattr(value, "__dict__"):
+        # result objects such as statsmodels DecomposeResult
+        return sys.getsizeof(value) + get_size(vars(value), depth - 1)
+    return sys.getsizeof(value)
+
+
+def copy_value(value):
+    """
+    hand out deep copies so in-place edits by a caller (df.iloc[...] = ,
+    fillna(inplace=True), changing a DecomposeResult) never reach the cached
+    object; strings, numbers and None are immutable and returned as they are
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=True)
+    if isinstance(value, tuple):
+        return tuple(copy_value(item) for item in value)
+    if isinstance(value, (str, bytes, int, float, type(None))):
+        return value
+    return copy.deepcopy(value)
+
+
+def freeze(value):
+    """hashable form of list/dict arguments for use in cache keys"""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    return value
+
+
+class ResultCache:
+    def __init__(self, max_mb=256):
+        self.max_bytes = int(max_mb * 2 ** 20)
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return True, self._items[key][0]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        size = get_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                _, (_, old_size) = self._items.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "mbytes": round(self._bytes / 2 ** 20, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+def cached(cache, signature=get_db_signature):
+    """
+    decorator for functions taking a sqlite3 connection first; results are
+    keyed by function, signature(conn) (default: the database signature)
+    and the remaining arguments
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(conn, *args, **kwargs):
+            try:
+                key = (func.__name__, signature(conn), freeze(args), freeze(kwargs))
+                hash(key)
+            except TypeError:
+                # arguments that still cannot be hashed are not cached
+                return func(conn, *args, **kwargs)
+
+            found, value = cache.get(key)
+            if not found:
+                value = func(conn, *args, **kwargs)
+                cache.put(key, value)
+                logger.info(f"cache miss {func.__name__}{args}: {cache.stats()}")
+
+            return copy_value(value)
+
+        return wrapper
+
+    return decorator
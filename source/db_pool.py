@@ -0,0 +1,162 @@
+# process-wide pool of read-only SQLite connections for the dashboard,
+# see ts_tools.get_db_connection / ts_tools.db_connection
+
+import atexit
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+from logzero import logger
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() returns it to the owning pool"""
+
+    pool = None
+    checked_out = False
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def discard(self):
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """
+    read-only connections kept per database file; a connection is used by
+    one thread at a time (acquire -> close), so check_same_thread=False is safe
+    """
+
+    def __init__(self, max_open=16, max_idle_per_db=4, idle_timeout=300, acquire_timeout=30):
+        self.max_open = max_open
+        self.max_idle_per_db = max_idle_per_db
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+
+        self._idle = {}
+        self._open = 0
+        self._cond = threading.Condition()
+
+    def _connect(self, db_file):
+        conn = sqlite3.connect(
+            f"file:{quote(db_file)}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            factory=PooledConnection,
+        )
+        conn.pool = self
+        conn.db_file = db_file
+        conn.checked_out = True
+        logger.info(f"pool connection opened: {db_file}")
+        return conn
+
+    def _evict_idle(self, now):
+        """close connections idle longer than idle_timeout; caller holds the lock"""
+        for db_file, idle in list(self._idle.items()):
+            keep = []
+            for conn, last_used in idle:
+                if now - last_used > self.idle_timeout:
+                    conn.discard()
+                    self._open -= 1
+                else:
+                    keep.append((conn, last_used))
+            if keep:
+                self._idle[db_file] = keep
+            else:
+                del self._idle[db_file]
+
+    def _evict_oldest(self):
+        """close the least recently used idle connection; caller holds the lock"""
+        oldest = None
+        for db_file, idle in self._idle.items():
+            if idle and (oldest is None or idle[0][1] < oldest[1]):
+                oldest = (db_file, idle[0][1])
+        if oldest is None:
+            return False
+
+        conn, _ = self._idle[oldest[0]].pop(0)
+        if not self._idle[oldest[0]]:
+            del self._idle[oldest[0]]
+        conn.discard()
+        self._open -= 1
+        return True
+
+    def acquire(self, db_file):
+        deadline = time.monotonic() + self.acquire_timeout
+
+        with self._cond:
+            while True:
+                self._evict_idle(time.monotonic())
+
+                idle = self._idle.get(db_file)
+                if idle:
+                    conn, _ = idle.pop()
+                    if not idle:
+                        del self._idle[db_file]
+                    conn.checked_out = True
+                    return conn
+
+                if self._open < self.max_open or self._evict_oldest():
+                    self._open += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"no pooled connection available for {db_file}")
+                self._cond.wait(remaining)
+
+        try:
+            return self._connect(db_file)
+        except sqlite3.Error:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        # a second close() of the same checkout is a no-op
+        if not conn.checked_out:
+            return
+        conn.checked_out = False
+
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._cond:
+            idle = self._idle.setdefault(conn.db_file, [])
+            if len(idle) >= self.max_idle_per_db:
+                conn.discard()
+                self._open -= 1
+            else:
+                idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.discard()
+                    self._open -= 1
+            self._idle.clear()
+        logger.info(f"connection pool closed, {self._open} connections still checked out")
+
+    def stats(self):
+        with self._cond:
+            return {
+                "open": self._open,
+                "idle": sum(len(idle) for idle in self._idle.values()),
+                "databases": len(self._idle),
+            }
+
+
+def create_pool(**kwargs):
+    """pool closed automatically at interpreter exit"""
+    pool = ConnectionPool(**kwargs)
+    atexit.register(pool.close_all)
+    return pool
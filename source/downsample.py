@@ -0,0 +1,142 @@
+# server-side point reduction for long time-series traces, so hourly
+# databases do not ship hundreds of thousands of points per trace:
+#   lttb   - largest-triangle-three-buckets, keeps the visual shape
+#   minmax - per-bucket min and max, keeps every peak (envelope)
+# see plot_tools.plot_irradiance / plot_multi_line and app1 zoom handling
+
+import re
+
+import numpy as np
+import pandas as pd
+
+modes = ("lttb", "minmax")
+
+# relayoutData keys for any (matched) x axis, e.g. "xaxis3.range[0]"
+range_key = re.compile(r"^xaxis\d*\.range(\[[01]\])?$")
+autorange_key = re.compile(r"^xaxis\d*\.autorange$")
+
+
+def lttb_indices(x, y, n_out):
+    """
+    input: float x and y arrays (x ascending, no NaN), target point count
+    functionality: largest-triangle-three-buckets selection, first and last
+                   points are always kept
+    return: sorted integer index array of length <= n_out
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # n - 2 interior points split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    prev = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+
+        # average of the next bucket (the last point for the final bucket)
+        if i < n_out - 3:
+            next_stop = edges[i + 2]
+            avg_x = x[stop:next_stop].mean()
+            avg_y = y[stop:next_stop].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+
+        # twice the triangle area for each candidate in the bucket
+        area = np.abs(
+            (x[prev] - avg_x) * (y[start:stop] - y[prev]) - (x[prev] - x[start:stop]) * (avg_y - y[prev])
+        )
+        prev = start + int(np.argmax(area))
+        indices[i + 1] = prev
+
+    return indices
+
+
+def minmax_indices(y, n_out):
+    """
+    input: y array (no NaN), target point count
+    functionality: index of the minimum and maximum of each of n_out / 2
+                   buckets, in time order, so the envelope keeps every peak
+    return: sorted integer index array of length <= n_out
+    """
+    n = len(y)
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(n)
+
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    picks = []
+    for start, stop in zip(edges[:-1], edges[1:]):
+        if stop > start:
+            bucket = y[start:stop]
+            picks.extend([start + int(np.argmin(bucket)), start + int(np.argmax(bucket))])
+
+    return np.unique(picks)
+
+
+def downsample(series, max_points, mode="lttb"):
+    """
+    input: Series with a sorted DatetimeIndex, target point count, mode
+    functionality: reduce the series to about max_points points, NaN rows
+                   are dropped first; series already short enough pass through
+    return: Series
+    """
+    if mode not in modes:
+        raise ValueError(f"downsample mode must be one of {modes}, not {mode}")
+
+    series = series.dropna()
+    if not max_points or len(series) <= max_points:
+        return series
+
+    y = series.to_numpy(dtype=np.float64)
+    if mode == "lttb":
+        x = series.index.asi8.astype(np.float64)
+        indices = lttb_indices(x, y, max_points)
+    else:
+        indices = minmax_indices(y, max_points)
+
+    return series.iloc[indices]
+
+
+def get_x_range(relayout_data):
+    """
+    input: dcc.Graph relayoutData
+    functionality: the zoomed x range of a relayout event
+    return: (start, end) Timestamps, "reset" for an autorange (double click),
+            None for events that do not change the x range
+    """
+    if not relayout_data:
+        return None
+
+    for key, value in relayout_data.items():
+        if autorange_key.match(key) and value:
+            return "reset"
+
+    bounds = {}
+    for key, value in relayout_data.items():
+        if not range_key.match(key):
+            continue
+        if key.endswith("[0]"):
+            bounds[0] = value
+        elif key.endswith("[1]"):
+            bounds[1] = value
+        else:
+            bounds[0], bounds[1] = value
+
+    if len(bounds) < 2:
+        return None
+
+    return pd.Timestamp(bounds[0]), pd.Timestamp(bounds[1])
+
+
+def get_window(df, x_range):
+    """rows of a DatetimeIndex frame inside x_range, plus one row either side"""
+    if not x_range or x_range == "reset":
+        return df
+
+    start = max(df.index.searchsorted(x_range[0]) - 1, 0)
+    stop = df.index.searchsorted(x_range[1], side="right") + 1
+    return df.iloc[start:stop]
@@ -0,0 +1,103 @@
+# bounded cache of rendered forecast figures for the Forecasting page,
+# keyed by (session, db, zipcode, feature, model) so concurrent users never
+# see each other's results; figures are kept as compact Plotly JSON in
+# memory with an optional on-disk tier that survives restarts
+
+import glob
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+from logzero import logger
+
+
+def get_key_hash(key):
+    return hashlib.sha256(json.dumps(list(key)).encode()).hexdigest()[:32]
+
+
+class FigureCache:
+    def __init__(self, max_mb=64, disk_path=None, disk_max_mb=256):
+        self.max_bytes = int(max_mb * 2 ** 20)
+        self.disk_path = disk_path
+        self.disk_max_bytes = int(disk_max_mb * 2 ** 20)
+
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        if disk_path:
+            os.makedirs(disk_path, exist_ok=True)
+
+    def put(self, key, fig):
+        """store a plotly Figure (or figure dict) under key"""
+        text = pio.to_json(fig, validate=False, pretty=False, remove_uids=True)
+
+        with self._lock:
+            self._put_memory(key, text)
+
+        if self.disk_path:
+            file_name = self.disk_path + get_key_hash(key) + ".json"
+            tmp_file = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_file, "w") as fh:
+                fh.write(text)
+            os.replace(tmp_file, file_name)
+            self._evict_disk()
+
+    def get(self, key):
+        """figure dict for key, None when not cached"""
+        with self._lock:
+            text = self._items.get(key)
+            if text is not None:
+                self._items.move_to_end(key)
+
+        if text is None and self.disk_path:
+            try:
+                with open(self.disk_path + get_key_hash(key) + ".json", "r") as fh:
+                    text = fh.read()
+            except OSError:
+                return None
+            with self._lock:
+                self._put_memory(key, text)
+
+        return json.loads(text) if text is not None else None
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "mbytes": round(self._bytes / 2 ** 20, 2)}
+
+    def _put_memory(self, key, text):
+        """caller holds the lock"""
+        if key in self._items:
+            self._bytes -= len(self._items.pop(key))
+        if len(text) > self.max_bytes:
+            return
+
+        self._items[key] = text
+        self._bytes += len(text)
+        while self._bytes > self.max_bytes:
+            _, old = self._items.popitem(last=False)
+            self._bytes -= len(old)
+
+    def _evict_disk(self):
+        """drop the oldest figure files above disk_max_mb"""
+        files = []
+        for file_name in glob.glob(self.disk_path + "*.json"):
+            try:
+                stat = os.stat(file_name)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, file_name))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, file_name in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(file_name)
+                total -= size
+                logger.info(f"figure cache: evicted {file_name}")
+            except OSError:
+                pass
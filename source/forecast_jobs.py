@@ -0,0 +1,200 @@
+# background ARIMA forecasts for the Forecasting page: each job runs in its
+# own spawned process (forecast_worker.run_forecast), at most max_running at
+# a time, so a forecast never holds a Dash worker; app3 submits, polls
+# through a dcc.Interval and cancels
+#
+# job states: queued -> running -> done | failed | cancelled
+
+import atexit
+import multiprocessing as mp
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from logzero import logger
+
+import forecast_worker
+
+states_finished = ("done", "failed", "cancelled")
+
+
+class JobLimitError(RuntimeError):
+    """too many forecasts queued or running"""
+
+
+class ForecastJobs:
+    """
+    process-backed job queue; finished jobs are kept keep_seconds for the
+    submitting page to collect, a daemon thread starts queued jobs and reaps
+    finished ones
+    """
+
+    def __init__(self, max_running=2, max_queued=8, keep_seconds=3600, target=forecast_worker.run_forecast):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.keep_seconds = keep_seconds
+        self.target = target
+
+        # spawn: the dashboard process is multi-threaded, fork is not safe
+        self._ctx = mp.get_context("spawn")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, params, data):
+        """queue a job on params and its input DataFrame, returning its id"""
+        with self._lock:
+            active = [job for job in self._jobs.values() if job["state"] not in states_finished]
+            if len(active) >= self.max_running + self.max_queued:
+                raise JobLimitError(f"{len(active)} forecasts already queued or running")
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "state": "queued",
+                "params": params,
+                "data": data,
+                "progress": 0,
+                "message": "queued",
+                "result": None,
+                "process": None,
+                "messages": None,
+                "submitted": time.time(),
+                "finished": None,
+            }
+            self._start_queued()
+
+        logger.info(f"forecast job {job_id} submitted: {params}")
+        return job_id
+
+    def cancel(self, job_id):
+        """cancel a queued job or terminate a running one"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["state"] in states_finished:
+                return False
+
+            process = job["process"]
+            if process is not None:
+                process.terminate()
+            self._finish(job, "cancelled", "cancelled")
+            self._start_queued()
+
+        # reaped outside the lock, polls and submits do not wait on a slow exit
+        if process is not None:
+            process.join(timeout=5)
+        logger.info(f"forecast job {job_id} cancelled")
+        return True
+
+    def status(self, job_id):
+        """state, progress, message and (when done) result of a job, None if unknown"""
+        with self._lock:
+            self._collect()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+
+            position = None
+            if job["state"] == "queued":
+                queued = [key for key, item in self._jobs.items() if item["state"] == "queued"]
+                position = queued.index(job_id) + 1
+
+            return {
+                "state": job["state"],
+                "progress": job["progress"],
+                "message": job["message"],
+                "position": position,
+                "result": job["result"],
+            }
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["state"]] = counts.get(job["state"], 0) + 1
+            return counts
+
+    def shutdown(self):
+        with self._lock:
+            for job in self._jobs.values():
+                if job["process"] is not None and job["state"] == "running":
+                    job["process"].terminate()
+                    self._finish(job, "cancelled", "shut down")
+
+    def _finish(self, job, state, message):
+        job["state"] = state
+        job["message"] = message
+        job["finished"] = time.time()
+        job["process"] = None
+        job["messages"] = None
+        job["data"] = None
+
+    def _start_queued(self):
+        """start queued jobs in submission order while slots are free; caller holds the lock"""
+        running = sum(1 for job in self._jobs.values() if job["state"] == "running")
+
+        for job in self._jobs.values():
+            if running >= self.max_running:
+                break
+            if job["state"] != "queued":
+                continue
+
+            job["messages"] = self._ctx.Queue()
+            job["process"] = self._ctx.Process(
+                target=self.target, args=(job["params"], job["data"], job["messages"]), daemon=True
+            )
+            job["process"].start()
+            job["state"] = "running"
+            job["message"] = "starting"
+            running += 1
+
+    def _collect(self):
+        """drain job messages, reap dead processes and expire old jobs; caller holds the lock"""
+        now = time.time()
+
+        for job_id, job in list(self._jobs.items()):
+            if job["state"] == "running":
+                # alive checked first so messages sent just before exit are drained
+                alive = job["process"].is_alive()
+                while job["state"] == "running":
+                    try:
+                        kind, *payload = job["messages"].get_nowait()
+                    except queue.Empty:
+                        break
+
+                    if kind == "progress":
+                        job["progress"], job["message"] = payload
+                    elif kind == "done":
+                        job["result"] = payload[0]
+                        job["progress"] = 100
+                        job["process"].join(timeout=5)
+                        self._finish(job, "done", "finished")
+                    else:
+                        job["process"].join(timeout=5)
+                        self._finish(job, "failed", payload[0])
+                        logger.error(f"forecast job {job_id} failed: {payload[0]}")
+
+                if job["state"] == "running" and not alive:
+                    self._finish(job, "failed", f"worker exited ({job['process'].exitcode})")
+                    logger.error(f"forecast job {job_id} worker exited")
+
+            elif job["finished"] and now - job["finished"] > self.keep_seconds:
+                del self._jobs[job_id]
+
+        self._start_queued()
+
+    def _dispatch_loop(self):
+        while True:
+            time.sleep(1)
+            with self._lock:
+                self._collect()
+
+
+def create_jobs(**kwargs):
+    """job queue whose running forecasts are terminated at interpreter exit"""
+    jobs = ForecastJobs(**kwargs)
+    atexit.register(jobs.shutdown)
+    return jobs
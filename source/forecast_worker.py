@@ -0,0 +1,47 @@
+# entry point of the spawned forecast job processes (see forecast_jobs.py);
+# kept apart from the dashboard modules so a job process imports only the
+# model code, the submitting process hands over the already loaded data
+
+import model_store
+import pmd_tools
+
+
+def run_forecast(params, df, messages):
+    """
+    job process entry point
+    input: job parameters (db_filename, zipcode, feature, models,
+           test_periods, fc_periods, model_store: ModelStore settings or
+           None), the feature's DataFrame, multiprocessing queue for messages
+    functionality: fit each requested model, reporting
+                   ("progress", percent, text) along the way
+    return: None, puts ("done", {model: forecast dict}) or ("failed", error)
+    """
+    try:
+        store_cfg = params.get("model_store")
+        store = model_store.ModelStore(**store_cfg) if store_cfg else None
+
+        steps = len(params["models"])
+        results = {}
+        for idx, model_name in enumerate(params["models"]):
+            messages.put(("progress", 100 * idx // (steps + 1), f"fitting {model_name} model"))
+            store_key = {
+                "db_filename": params["db_filename"],
+                "zipcode": params["zipcode"],
+                "feature": params["feature"],
+                "model": model_name,
+                "test_periods": params["test_periods"],
+                "fc_periods": params["fc_periods"],
+            }
+            results[model_name] = pmd_tools.forecast_feature(
+                df,
+                params["feature"],
+                model_name,
+                test_periods=params["test_periods"],
+                fc_periods=params["fc_periods"],
+                store=store,
+                store_key=store_key,
+            )
+
+        messages.put(("done", results))
+    except Exception as err:
+        messages.put(("failed", f"{type(err).__name__}: {err}"))
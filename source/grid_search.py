@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# parallel order search for statsmodels ARIMA / SARIMA / VARMAX models,
+# promoted from the optimizers in archives/gm/source/ts_tools.py: fits fan
+# out over a process pool, each fit has a timeout, failures are kept with
+# their reason, and the grid can be pruned by AIC in waves of model size
+#
+# usage:
+#   python grid_search.py ../data/db/nsrdb_monthly.db 85286 GHI --kind sarima --workers 8
+#   python grid_search.py ../data/db/nsrdb_monthly.db 85286 GHI --bench
+
+import argparse
+import os
+import signal
+import sqlite3
+import sys
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from time import perf_counter
+
+import logzero
+import numpy as np
+import pandas as pd
+from logzero import logger
+from statsmodels.tsa.arima.model import ARIMA
+from statsmodels.tsa.statespace.varmax import VARMAX
+
+sys.path.append("../source")
+import queries
+
+
+# result column names as returned by the archived optimizers
+order_columns = {
+    "arima": "(p, d, q)",
+    "sarima": "(p, d, q, P, D, Q)",
+    "varmax": "(p, q)",
+}
+
+
+class FitTimeout(Exception):
+    pass
+
+
+def gen_arima_params(p_rng=(0, 0), d_rng=(0, 0), q_rng=(0, 0), debug=False):
+    """
+    input: 3 2-tuples of inclusive value ranges
+           Boolean for debug printing
+    functionality: produce a cartesian product of the inputs
+    output: list of 3-tuple products
+    """
+    order_list = list(
+        product(
+            range(p_rng[0], p_rng[1] + 1),
+            range(d_rng[0], d_rng[1] + 1),
+            range(q_rng[0], q_rng[1] + 1),
+        )
+    )
+
+    if debug:
+        print(f"ARIMA Order list length: {len(order_list)}")
+        print(f"ARIMA Order list\n {order_list[:3]}")
+
+    return order_list
+
+
+def gen_sarima_params(
+    p_rng=(0, 0),
+    d_rng=(0, 0),
+    q_rng=(0, 0),
+    P_rng=(0, 0),
+    D_rng=(0, 0),
+    Q_rng=(0, 0),
+    debug=False,
+):
+    """
+    input: 6 2-tuples of inclusive value ranges
+           Boolean for debug printing
+    functionality: produce a cartesian product of the inputs
+    output: list of 6-tuple products
+    """
+    order_list = list(
+        product(
+            range(p_rng[0], p_rng[1] + 1),
+            range(d_rng[0], d_rng[1] + 1),
+            range(q_rng[0], q_rng[1] + 1),
+            range(P_rng[0], P_rng[1] + 1),
+            range(D_rng[0], D_rng[1] + 1),
+            range(Q_rng[0], Q_rng[1] + 1),
+        )
+    )
+
+    if debug:
+        print(f"SARIMA Order list length: {len(order_list)}")
+        print(f"SARIMA Order list\n {order_list[:3]}")
+
+    return order_list
+
+
+def gen_varmax_params(p_rng=(0, 0), q_rng=(0, 0), debug=False):
+    """
+    input: 2 2-tuples of inclusive (p, q) value ranges
+           Boolean for debug printing
+    functionality: produce a cartesian product of the inputs
+    output: list of 2-tuple products
+    """
+    order_list = list(product(range(p_rng[0], p_rng[1] + 1), range(q_rng[0], q_rng[1] + 1)))
+
+    if debug:
+        print(f"VARMA Order list length: {len(order_list)}")
+        print(f"VARMA Order list\n {order_list[:3]}")
+
+    return order_list
+
+
+def fit_model(kind, data, order, s=0):
+    """fit one order, return its AIC"""
+    if kind == "arima":
+        model = ARIMA(data, order=order).fit()
+    elif kind == "sarima":
+        model = ARIMA(
+            data,
+            order=tuple(order[:3]),
+            seasonal_order=tuple(order[3:]) + (s,),
+            enforce_stationarity=True,
+        ).fit()
+    elif kind == "varmax":
+        model = VARMAX(data, order=order, enforce_stationarity=True, trend="c").fit(disp=False)
+    else:
+        raise ValueError(f"unknown model kind: {kind}")
+
+    return model.aic
+
+
+# series shared with pool workers once, through the initializer
+_worker_data = None
+
+
+def init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def raise_timeout(signum, frame):
+    raise FitTimeout()
+
+
+def fit_order(kind, order, s=0, timeout=None):
+    """
+    worker process: fit one order with an optional timeout (seconds)
+    return: dict of order, aic, status (ok, failed, timeout), reason and seconds
+    """
+    # SIGALRM is unix-only, elsewhere fits run unbounded
+    use_alarm = timeout and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    start = perf_counter()
+    result = {"order": tuple(order), "aic": np.nan, "status": "ok", "reason": None}
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            result["aic"] = fit_model(kind, _worker_data, order, s)
+        if not np.isfinite(result["aic"]):
+            result["status"], result["reason"] = "failed", "non-finite AIC"
+        elif caught:
+            result["reason"] = "; ".join(sorted({type(w.message).__name__ for w in caught}))
+    except FitTimeout:
+        result["status"], result["reason"] = "timeout", f"exceeded {timeout}s"
+    except Exception as err:
+        result["status"], result["reason"] = "failed", f"{type(err).__name__}: {err}"
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+    result["seconds"] = perf_counter() - start
+    return result
+
+
+def get_diff_key(kind, order):
+    """differencing terms of an order; AICs are comparable only between equal keys"""
+    if kind == "arima":
+        return (order[1],)
+    if kind == "sarima":
+        return (order[1], order[4])
+    return ()
+
+
+def get_waves(orders):
+    """orders grouped by model size (sum of the order terms), smallest first"""
+    waves = {}
+    for order in orders:
+        waves.setdefault(sum(order), []).append(tuple(order))
+    return [waves[size] for size in sorted(waves)]
+
+
+def grid_search(
+    kind, data, orders, s=0, workers=None, timeout=None, prune_delta=None, patience=1, debug=False
+):
+    """
+    input: "arima" | "sarima" | "varmax", Series (DataFrame for varmax),
+           list of order tuples, seasonal period for sarima, process count,
+           per-fit timeout in seconds, AIC pruning margin and patience
+    functionality: fit every order in a process pool; with prune_delta the
+                   grid runs in waves of increasing model size, and orders of
+                   one differencing (d, D) stop once `patience` consecutive
+                   waves fail to come within prune_delta of that
+                   differencing's best AIC so far (likelihoods of series
+                   differenced differently are not comparable)
+    return: DataFrame of order, AIC, status, reason and seconds for every
+            attempted fit, best AIC first, failures last
+    """
+    workers = workers or os.cpu_count()
+    waves = get_waves(orders) if prune_delta is not None else [list(map(tuple, orders))]
+
+    results = []
+    best_aic = {}
+    stale = {}
+    stopped = set()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(data,)) as executor:
+        for idx, wave in enumerate(waves):
+            wave = [order for order in wave if get_diff_key(kind, order) not in stopped]
+            if not wave:
+                continue
+            wave_results = list(
+                executor.map(fit_order, [kind] * len(wave), wave, [s] * len(wave), [timeout] * len(wave))
+            )
+            results.extend(wave_results)
+
+            wave_best = {get_diff_key(kind, order): np.inf for order in wave}
+            for item in wave_results:
+                if item["status"] == "ok":
+                    key = get_diff_key(kind, item["order"])
+                    wave_best[key] = min(wave_best[key], item["aic"])
+            if debug:
+                print(f"wave {idx}: {len(wave)} fits, best AIC {min(wave_best.values()):0.2f}")
+
+            if prune_delta is None:
+                continue
+
+            for key, aic in wave_best.items():
+                best = best_aic.get(key, np.inf)
+                stale[key] = 0 if aic < best + prune_delta else stale.get(key, 0) + 1
+                best_aic[key] = min(best, aic)
+                if stale[key] >= patience:
+                    stopped.add(key)
+
+    pruned = len(orders) - len(results)
+
+    df = pd.DataFrame(results, columns=["order", "aic", "status", "reason", "seconds"])
+    df["failed"] = df["status"] != "ok"
+    df = df.sort_values(by=["failed", "aic"]).drop(columns="failed").reset_index(drop=True)
+    df.rename(columns={"order": order_columns[kind], "aic": "AIC"}, inplace=True)
+
+    failures = int((df["status"] != "ok").sum())
+    logger.info(f"{kind} grid search: {len(df)} fits, {failures} failed, {pruned} pruned")
+
+    return df
+
+
+def ARIMA_optimizer(series, arima_order, workers=None, timeout=None, prune_delta=None, debug=False):
+    """parallel grid_search over (p, d, q) orders"""
+    return grid_search(
+        "arima", series, arima_order, workers=workers, timeout=timeout, prune_delta=prune_delta, debug=debug
+    )
+
+
+def SARIMA_optimizer(
+    series, sarima_order, s=0, workers=None, timeout=None, prune_delta=None, debug=False
+):
+    """parallel grid_search over (p, d, q, P, D, Q) orders with seasonal period s"""
+    return grid_search(
+        "sarima",
+        series,
+        sarima_order,
+        s=s,
+        workers=workers,
+        timeout=timeout,
+        prune_delta=prune_delta,
+        debug=debug,
+    )
+
+
+def VARMAX_optimizer(frame, varmax_order, workers=None, timeout=None, prune_delta=None, debug=False):
+    """parallel grid_search over (p, q) orders of a multivariate frame"""
+    return grid_search(
+        "varmax", frame, varmax_order, workers=workers, timeout=timeout, prune_delta=prune_delta, debug=debug
+    )
+
+
+def get_series(db_file, zipcode, feature):
+    conn = sqlite3.connect(db_file)
+    df = pd.read_sql(
+        queries.select_nsr_rows,
+        conn,
+        params={"zipcode": zipcode},
+        index_col="date_time",
+        parse_dates=["date_time"],
+    )
+    conn.close()
+    series = df[feature].sort_index()
+    return series.asfreq(pd.infer_freq(series.index)) if len(series) > 2 else series
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parallel ARIMA/SARIMA order search on one zip code")
+    parser.add_argument("db_file", help="monthly nsrdb database")
+    parser.add_argument("zipcode")
+    parser.add_argument("feature")
+    parser.add_argument("--kind", choices=["arima", "sarima"], default="sarima")
+    parser.add_argument("--max-order", type=int, default=1, help="upper bound of every order term")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--timeout", type=float, default=60, help="seconds per fit")
+    parser.add_argument("--prune-delta", type=float, help="AIC margin for wave pruning, default: off")
+    parser.add_argument("--bench", action="store_true", help="also time one worker and report the speed-up")
+    args = parser.parse_args()
+
+    log_path = "logs/"
+    log_file = "grid_search.log"
+    logzero.logfile(log_path + log_file, maxBytes=1e5, backupCount=5, disableStderrLogger=True)
+
+    series = get_series(args.db_file, args.zipcode, args.feature)
+    rng = (0, args.max_order)
+    if args.kind == "sarima":
+        orders = gen_sarima_params(rng, rng, rng, rng, rng, rng)
+    else:
+        orders = gen_arima_params(rng, rng, rng)
+
+    start = perf_counter()
+    df = grid_search(
+        args.kind,
+        series,
+        orders,
+        s=12,
+        workers=args.workers,
+        timeout=args.timeout,
+        prune_delta=args.prune_delta,
+    )
+    elapsed = perf_counter() - start
+
+    print(df.head(10).to_string())
+    print(f"{len(df)} of {len(orders)} orders fitted in {elapsed:0.1f}s on {args.workers} workers")
+    print(df["status"].value_counts().to_string())
+
+    if args.bench:
+        start = perf_counter()
+        grid_search(args.kind, series, orders, s=12, workers=1, timeout=args.timeout, prune_delta=args.prune_delta)
+        serial = perf_counter() - start
+        print(f"1 worker: {serial:0.1f}s, speed-up: {serial / elapsed:0.1f}x")
+
+
+if __name__ == "__main__":
+    main()
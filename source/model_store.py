@@ -0,0 +1,156 @@
+# on-disk store of fitted pmdarima models for the Forecasting page, so an
+# unchanged (database, zip code, feature, model) is not refit on every click
+#
+# <model_path>/<key hash>.pickle   fitted model (train split only)
+# <model_path>/<key hash>.json     key, data fingerprint, fit time, usage
+#
+# files are replaced atomically, so concurrent forecast jobs can share a store
+
+import glob
+import hashlib
+import json
+import os
+import pickle
+import time
+from time import perf_counter
+
+import pandas as pd
+from logzero import logger
+
+
+def get_fingerprint(series):
+    """sha256 of a series' index and values"""
+    hashed = pd.util.hash_pandas_object(series, index=True).values
+    return hashlib.sha256(hashed.tobytes()).hexdigest()
+
+
+def get_key_hash(key):
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def write_atomic(file_name, data, mode="wb"):
+    tmp_file = f"{file_name}.{os.getpid()}.tmp"
+    with open(tmp_file, mode) as fh:
+        fh.write(data)
+    os.replace(tmp_file, file_name)
+
+
+class ModelStore:
+    def __init__(self, model_path="../data/models/", max_mb=512, max_age_days=30):
+        self.model_path = model_path
+        self.max_bytes = int(max_mb * 2 ** 20)
+        self.max_age = max_age_days * 86400
+        os.makedirs(model_path, exist_ok=True)
+
+    def _files(self, key):
+        base = self.model_path + get_key_hash(key)
+        return base + ".pickle", base + ".json"
+
+    def load(self, key):
+        """(model, metadata) stored for key, (None, None) when missing or unreadable"""
+        model_file, meta_file = self._files(key)
+        try:
+            with open(meta_file, "r") as fh:
+                meta = json.load(fh)
+            with open(model_file, "rb") as fh:
+                model = pickle.load(fh)
+        except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+            return None, None
+
+        meta["last_used"] = time.time()
+        write_atomic(meta_file, json.dumps(meta), mode="w")
+        return model, meta
+
+    def save(self, key, model, train, fit_seconds):
+        model_file, meta_file = self._files(key)
+        data = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+        meta = {
+            "key": key,
+            "fingerprint": get_fingerprint(train),
+            "n_obs": len(train),
+            "last_index": str(train.index[-1]),
+            "model": str(model),
+            "fit_seconds": round(fit_seconds, 2),
+            "created": time.time(),
+            "last_used": time.time(),
+            "bytes": len(data),
+        }
+
+        # model first: a metadata file always has its model
+        write_atomic(model_file, data)
+        write_atomic(meta_file, json.dumps(meta), mode="w")
+        self.evict()
+
+    def get_model(self, key, train, fit_func):
+        """
+        input: store key (dict of JSON values), train Series, fitting function
+        functionality: reuse the stored model when train is unchanged, update
+                       it with the new observations when train only grew, and
+                       refit (then store) otherwise
+        return: (model fitted on train, "reused" | "updated" | "fitted")
+        """
+        model, meta = self.load(key)
+
+        if model is not None:
+            n_obs = meta["n_obs"]
+            if n_obs == len(train) and meta["fingerprint"] == get_fingerprint(train):
+                logger.info(f"model store: reused {key}")
+                return model, "reused"
+
+            if n_obs < len(train) and meta["fingerprint"] == get_fingerprint(train.iloc[:n_obs]):
+                start = perf_counter()
+                model.update(train.iloc[n_obs:])
+                self.save(key, model, train, meta["fit_seconds"] + perf_counter() - start)
+                logger.info(f"model store: updated {key} with {len(train) - n_obs} observations")
+                return model, "updated"
+
+        start = perf_counter()
+        model = fit_func(train)
+        fit_seconds = perf_counter() - start
+        self.save(key, model, train, fit_seconds)
+        logger.info(f"model store: fitted {key} in {fit_seconds:0.1f}s")
+        return model, "fitted"
+
+    def entries(self):
+        """metadata of every stored model"""
+        entries = []
+        for meta_file in glob.glob(self.model_path + "*.json"):
+            try:
+                with open(meta_file, "r") as fh:
+                    meta = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            meta["meta_file"] = meta_file
+            entries.append(meta)
+        return entries
+
+    def remove(self, meta_file):
+        for file_name in (meta_file, meta_file[: -len(".json")] + ".pickle"):
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+
+    def evict(self):
+        """drop models older than max_age_days, then least recently used ones above max_mb"""
+        now = time.time()
+        entries = sorted(self.entries(), key=lambda meta: meta["last_used"])
+
+        kept = []
+        for meta in entries:
+            if now - meta["created"] > self.max_age:
+                self.remove(meta["meta_file"])
+            else:
+                kept.append(meta)
+
+        total = sum(meta["bytes"] for meta in kept)
+        for meta in kept:
+            if total <= self.max_bytes:
+                break
+            self.remove(meta["meta_file"])
+            total -= meta["bytes"]
+            logger.info(f"model store: evicted {meta['key']}")
+
+    def stats(self):
+        entries = self.entries()
+        return {"models": len(entries), "mbytes": round(sum(meta["bytes"] for meta in entries) / 2 ** 20, 2)}
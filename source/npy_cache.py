@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# on-disk cache of each zip code's nsrdb rows as fixed-layout .npy files,
+# opened with np.load(mmap_mode="r") so reads are zero-copy and every Dash
+# worker process shares the same pages through the OS page cache
+#
+# <cache_path>/<db name>/<zipcode>.npy        float32 (rows, len(columns))
+# <cache_path>/<db name>/<zipcode>.time.npy   datetime64[ns] (rows,)
+# <cache_path>/<db name>/<zipcode>.json       columns, rows, zip code version
+#
+# a zip code is rebuilt on its next read once its version (row count and
+# newest rowid in nsrdb, queries.select_zip_version) differs from the one it
+# was built from, so writes to other zip codes or other tables (forecasts)
+# leave it alone; used by ts_tools.get_irr_data when config.yml -> storage ->
+# backend is "npy"
+#
+# prebuild every zip code of a database:
+#   python npy_cache.py ../data/db/nsrdb_monthly.db
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import yaml
+from logzero import logger
+from yaml import load
+
+sys.path.append("../source")
+import queries
+
+
+def get_db_file(conn):
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA database_list;")
+    return {row[1]: row[2] for row in cursor.fetchall()}["main"]
+
+
+def get_zip_version(conn, zipcode):
+    """[row count, newest rowid] of the zip code's nsrdb rows"""
+    cursor = conn.cursor()
+    cursor.execute(queries.select_zip_version, {"zipcode": zipcode})
+    return list(cursor.fetchone())
+
+
+class NpyCache:
+    def __init__(self, cache_path="../data/npy_cache/", chunk_rows=50000, max_open=64):
+        self.cache_path = cache_path
+        self.chunk_rows = chunk_rows
+        self.max_open = max_open
+        self.columns = list(queries.nsr_row_columns)
+
+        # open maps per file, least recently used first, reused while the
+        # metadata is unchanged; each holds two file descriptors
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "builds": 0}
+
+    def _files(self, db_file, zipcode):
+        base = os.path.join(self.cache_path, os.path.splitext(os.path.basename(db_file))[0], str(zipcode))
+        return base + ".npy", base + ".time.npy", base + ".json"
+
+    def _load_meta(self, meta_file):
+        try:
+            with open(meta_file, "r") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, conn, zipcode):
+        """
+        input: sqlite3 connection, zip code
+        functionality: open the zip code's cached matrix, (re)building it
+                       first when missing or built from an older version of its rows
+        return: (datetime64 times, float32 values) read-only memmaps,
+                None when the zip code could not be cached
+        """
+        version = get_zip_version(conn, zipcode)
+        data_file, time_file, meta_file = self._files(get_db_file(conn), zipcode)
+
+        meta = self._load_meta(meta_file)
+        if meta is None or meta.get("version") != version or meta["columns"] != self.columns:
+            meta = self.build(conn, zipcode, version)
+            if meta is None:
+                return None
+        else:
+            with self._lock:
+                self._stats["hits"] += 1
+
+        key = (data_file, meta["built"])
+        with self._lock:
+            maps = self._maps.get(data_file)
+            if maps is None or maps[0] != key:
+                maps = (key, np.load(time_file, mmap_mode="r"), np.load(data_file, mmap_mode="r"))
+                self._maps[data_file] = maps
+            self._maps.move_to_end(data_file)
+            # dropped maps close once no returned frame still uses them
+            while len(self._maps) > self.max_open:
+                self._maps.popitem(last=False)
+
+        return maps[1], maps[2]
+
+    def build(self, conn, zipcode, version=None):
+        """write the zip code's rows chunk by chunk into new .npy files, return the metadata"""
+        start = perf_counter()
+        version = version or get_zip_version(conn, zipcode)
+        data_file, time_file, meta_file = self._files(get_db_file(conn), zipcode)
+        os.makedirs(os.path.dirname(data_file), exist_ok=True)
+
+        rows = version[0]
+        if rows == 0:
+            return None
+
+        cursor = conn.cursor()
+        sql = queries.select_nsr_rows_window.format(
+            table="nsrdb", columns=", ".join(f'"{col}"' for col in self.columns)
+        )
+        cursor.execute(sql, {"zipcode": zipcode, "start": "0000", "end": "9999"})
+
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        values = np.lib.format.open_memmap(
+            data_file + suffix, mode="w+", dtype=np.float32, shape=(rows, len(self.columns))
+        )
+        times = np.lib.format.open_memmap(
+            time_file + suffix, mode="w+", dtype="datetime64[ns]", shape=(rows,)
+        )
+
+        filled = 0
+        while True:
+            chunk = cursor.fetchmany(self.chunk_rows)
+            if not chunk:
+                break
+            stop = min(filled + len(chunk), rows)
+            df = pd.DataFrame.from_records(
+                chunk[: stop - filled], columns=["date_time"] + self.columns, coerce_float=True
+            )
+            times[filled:stop] = pd.to_datetime(df.pop("date_time"), format="%Y-%m-%d %H:%M:%S").to_numpy()
+            values[filled:stop] = df.to_numpy(dtype=np.float32)
+            filled += len(chunk)
+
+        values.flush()
+        times.flush()
+        del values, times
+
+        if filled != rows:
+            # the database changed between count and read; serve from SQLite this time
+            logger.warning(f"npy cache: {zipcode} read {filled} of {rows} rows, not cached")
+            for tmp_file in (data_file + suffix, time_file + suffix):
+                os.remove(tmp_file)
+            return None
+
+        os.replace(data_file + suffix, data_file)
+        os.replace(time_file + suffix, time_file)
+
+        # metadata last: it is what marks the .npy files as current
+        meta = {"version": version, "columns": self.columns, "rows": rows, "built": time.time()}
+        with open(meta_file + suffix, "w") as fh:
+            json.dump(meta, fh)
+        os.replace(meta_file + suffix, meta_file)
+
+        with self._lock:
+            self._stats["builds"] += 1
+        logger.info(f"npy cache: built {zipcode}, {rows} rows in {perf_counter() - start:0.2f}s")
+        return meta
+
+    def read_irr_data(self, conn, zipcode, columns=None, start=None, end=None):
+        """
+        input: sqlite3 connection, zip code, optional column list and
+               inclusive start/end Timestamps
+        functionality: slice the memmaps by binary search on the time vector;
+                       all columns come back without copying
+        return: float32 DataFrame indexed by date_time, None when not cacheable
+        """
+        maps = self.get(conn, zipcode)
+        if maps is None:
+            return None
+        times, values = maps
+
+        lo = np.searchsorted(times, pd.Timestamp(start).to_datetime64()) if start is not None else 0
+        hi = len(times)
+        if end is not None:
+            hi = np.searchsorted(times, pd.Timestamp(end).to_datetime64(), side="right")
+
+        columns = list(columns or self.columns)
+        if columns == self.columns:
+            data = values[lo:hi]
+        else:
+            data = values[lo:hi, [self.columns.index(col) for col in columns]]
+
+        index = pd.DatetimeIndex(times[lo:hi], name="date_time")
+        return pd.DataFrame(data, index=index, columns=columns, copy=False)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, open_maps=len(self._maps))
+
+
+def main():
+    configs = None
+    try:
+        with open("../source/config.yml", "r") as config_in:
+            configs = load(config_in, Loader=yaml.SafeLoader)
+    except:
+        print(f"config file open failure.")
+        exit(1)
+
+    parser = argparse.ArgumentParser(description="build the memory-mapped .npy cache of a database")
+    parser.add_argument("db_file", help="nsrdb database")
+    parser.add_argument("--zipcodes", nargs="+", help="default: every zip code in the database")
+    parser.add_argument("--cache-path", default=configs["npy_cache"]["cache_path"])
+    args = parser.parse_args()
+
+    cache = NpyCache(args.cache_path)
+    conn = sqlite3.connect(args.db_file)
+    zipcodes = args.zipcodes
+    if not zipcodes:
+        cursor = conn.cursor()
+        cursor.execute(queries.select_distinct_zips)
+        zipcodes = sorted(row[0] for row in cursor.fetchall())
+
+    start = perf_counter()
+    for zipcode in zipcodes:
+        cache.get(conn, zipcode)
+    conn.close()
+
+    print(
+        f"{args.db_file}: {len(zipcodes)} zip codes cached in {perf_counter() - start:0.1f}s, {cache.stats()}"
+    )
+
+
+if __name__ == "__main__":
+    main()
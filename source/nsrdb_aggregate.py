@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# incremental build of the aggregated (monthly) database from the raw
+# nsrdb_<zipcode>_<year>.csv files, replacing notebooks/nsrdb_aggregator.ipynb:
+# files are tracked by path, size and mtime in aggregated_files, so a rerun
+# only resamples new or changed files; each file replaces its zip-year rows
+#
+# usage:
+#   python nsrdb_aggregate.py                       # configured raw path and database
+#   python nsrdb_aggregate.py --workers 8
+#   python nsrdb_aggregate.py --db-file ../data/db/nsrdb_monthly.db --force
+
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+import logzero
+import yaml
+from logzero import logger
+from tqdm import tqdm
+from yaml import load
+
+sys.path.append("../source")
+import bulk_loader
+import nsrdb_dtypes
+import nsrdb_migrate
+import psm3_parser
+import queries
+import zip_catalog
+
+
+nsrdb_conv = "nsrdb_?????_????.csv"
+nsrdb_pattern = re.compile(r"nsrdb_(\d{5})_(\d{4})\.csv$")
+
+# raw columns kept in the aggregated database
+cols = [
+    "date_time",
+    "zipcode",
+    "location_id",
+    "Temperature",
+    "Clearsky_DHI",
+    "Clearsky_DNI",
+    "Clearsky_GHI",
+    "Dew_Point",
+    "DHI",
+    "DNI",
+    "GHI",
+    "Relative_Humidity",
+    "Pressure",
+    "Precipitable_Water",
+    "Wind_Speed",
+    "Global_Horizontal_UV_Irradiance_(280-400nm)",
+    "Global_Horizontal_UV_Irradiance_(295-385nm)",
+]
+
+rename_cols = {
+    "Global_Horizontal_UV_Irradiance_(280-400nm)": "GHI_UV_wd",
+    "Global_Horizontal_UV_Irradiance_(295-385nm)": "GHI_UV_nw",
+}
+
+
+def get_csv_files(csv_path):
+    """{path: (size, mtime)} of every raw nsrdb file in csv_path"""
+    files = {}
+    for path in sorted(glob.glob(os.path.join(csv_path, nsrdb_conv))):
+        stat = os.stat(path)
+        files[os.path.abspath(path)] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+def get_pending(conn, files, force=False):
+    """paths whose size or mtime differ from the aggregated_files record"""
+    cursor = conn.cursor()
+    cursor.execute(queries.select_aggregated_files)
+    done = {} if force else {path: (size, mtime) for path, size, mtime in cursor.fetchall()}
+
+    return [path for path, stat in files.items() if done.get(path) != stat]
+
+
+def aggregate_file(path, period):
+    """
+    worker process: resample one raw file to the aggregation period
+    return: (path, zipcode, year, DataFrame) or (path, zipcode, year, error text)
+    """
+    zipcode, year = nsrdb_pattern.search(path).groups()
+    try:
+        df = psm3_parser.read_raw_csv(path, usecols=cols).drop(columns="zipcode")
+        # means over the parsed decimals, not their float32 approximations
+        df = nsrdb_dtypes.widen(df)
+        df = df.set_index("date_time").resample(period).mean()
+    except Exception as err:
+        return path, zipcode, int(year), f"{type(err).__name__}: {err}"
+
+    df = df.round(decimals=5).reset_index(drop=False)
+    df.rename(rename_cols, axis=1, inplace=True)
+    df["zipcode"] = zipcode
+    df["location_id"] = df["location_id"].astype("int64")
+
+    return path, zipcode, int(year), df
+
+
+def create_db(conn, geo_db_file=None):
+    """monthly nsrdb table, migrated, with geo_zipcodes imported once when given"""
+    cursor = conn.cursor()
+    cursor.execute(queries.create_table_monthly_nsrdb)
+    cursor.execute(queries.create_table_geo_zipcodes)
+    cursor.execute(queries.create_table_aggregated_files)
+    conn.commit()
+    nsrdb_migrate.migrate(conn)
+
+    cursor.execute("select count(*) from geo_zipcodes;")
+    if geo_db_file and os.path.exists(geo_db_file) and cursor.fetchone()[0] == 0:
+        cursor.execute("ATTACH DATABASE ? AS gzc_db;", (geo_db_file,))
+        cursor.execute("INSERT INTO 'geo_zipcodes' SELECT * FROM gzc_db.geo_zipcodes;")
+        conn.commit()
+        cursor.execute("DETACH gzc_db;")
+        logger.info(f"geo_zipcodes imported from {geo_db_file}")
+
+
+def aggregate(conn, files, period, workers=None):
+    """
+    input: sqlite3 connection, {path: (size, mtime)} to aggregate,
+           pandas resample period, process count
+    functionality: resample files in a process pool and replace each
+                   file's zip-year rows in nsrdb as results arrive, then
+                   record the file and refresh the zip catalog
+    return: dict of files done, failed and rows written
+    """
+    stats = {"done": 0, "failed": 0, "rows": 0}
+    zipcodes = set()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(aggregate_file, path, period) for path in files]
+
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            path, zipcode, year, df = future.result()
+
+            if isinstance(df, str):
+                stats["failed"] += 1
+                logger.error(f"{path} failed: {df}")
+                continue
+
+            delete_params = {"zipcode": zipcode, "start": f"{year:04d}-01-01", "end": f"{year + 1:04d}-01-01"}
+            file_params = {
+                "path": path,
+                "size": files[path][0],
+                "mtime": files[path][1],
+                "zipcode": zipcode,
+                "year": year,
+                "row_count": len(df),
+            }
+            # old zip-year rows, new rows and the file record commit together
+            bulk_loader.bulk_insert(
+                conn,
+                "nsrdb",
+                df,
+                pre_statements=[
+                    (queries.delete_nsrdb_zip_year, delete_params),
+                    (queries.upsert_aggregated_file, file_params),
+                ],
+            )
+
+            stats["done"] += 1
+            stats["rows"] += len(df)
+            zipcodes.add(zipcode)
+
+    if zipcodes:
+        zip_catalog.refresh(conn, sorted(zipcodes))
+
+    return stats
+
+
+def main():
+    configs = None
+    try:
+        with open("../source/config.yml", "r") as config_in:
+            configs = load(config_in, Loader=yaml.SafeLoader)
+    except:
+        print(f"config file open failure.")
+        exit(1)
+
+    period = configs["aggregation"]["period"]
+    db_file = (
+        configs["file_paths"]["downloads_path_db"]
+        + configs["location_info"]["city"]
+        + "_"
+        + configs["location_info"]["state"]
+        + "_"
+        + period
+        + ".db"
+    )
+    geo_db_file = configs["file_paths"]["db_path"] + configs["file_names"]["db_file_gzc"]
+
+    parser = argparse.ArgumentParser(description="aggregate new or changed raw nsrdb csv files")
+    parser.add_argument("--csv-path", default=configs["file_paths"]["downloads_path_raw"])
+    parser.add_argument("--db-file", default=db_file)
+    parser.add_argument("--period", default=period, help="pandas resample rule")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="re-aggregate every file")
+    args = parser.parse_args()
+
+    log_path = "logs/"
+    log_file = "nsrdb_aggregate.log"
+    logzero.logfile(log_path + log_file, maxBytes=1e5, backupCount=5, disableStderrLogger=True)
+
+    conn = sqlite3.connect(args.db_file, timeout=60)
+    create_db(conn, geo_db_file if configs["zip_import"][True] else None)
+
+    files = get_csv_files(args.csv_path)
+    pending = get_pending(conn, files, force=args.force)
+    print(f"{args.db_file}: {len(pending)} of {len(files)} raw files to aggregate on {args.workers} workers")
+    logger.info(f"{len(pending)} pending files: {args}")
+
+    start = perf_counter()
+    stats = aggregate(conn, {path: files[path] for path in pending}, args.period, workers=args.workers)
+    conn.close()
+
+    elapsed = perf_counter() - start
+    print(
+        f"files done: {stats['done']}, failed: {stats['failed']}, rows: {stats['rows']}, "
+        + f"elapsed: {elapsed:0.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
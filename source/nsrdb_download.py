@@ -1,8 +1,9 @@
 # see ./notebooks/nsrdb_download.ipynb for details related to this script
 
+import argparse
+import os
 import sqlite3
 import sys
-from time import sleep
 
 import logzero
 import numpy as np
@@ -13,10 +14,22 @@ from tqdm import tqdm
 from yaml import dump, load, safe_load
 
 sys.path.append("../source")
+import bulk_loader
+import nsrdb_manifest
+import nsrdb_migrate
+import nsrdb_rollup
+import nsrdb_scheduler
+import parquet_store
+import psm3_parser
 import queries
+import zip_catalog
 from secret import nrel_key
 
 
+parser = argparse.ArgumentParser(description="download NSRDB PSM3 data for the configured zip codes")
+parser.add_argument("--pending", action="store_true", help="report the zip-years still to download and exit")
+args = parser.parse_args()
+
 log_path = "logs/"
 log_file = "nsrdb_download.log"
 
@@ -36,6 +49,15 @@ except:
 cfg_vars = configs["url_variables"]
 logger.info(f"variables: {cfg_vars}\n")
 
+sched_cfg = nsrdb_scheduler.get_scheduler_config(configs)
+logger.info(f"scheduler: {sched_cfg}\n")
+
+storage_cfg = configs["storage"]
+logger.info(f"storage: {storage_cfg}\n")
+
+load_cfg = configs["bulk_load"]
+logger.info(f"bulk load: {load_cfg}\n")
+
 years = configs["request_years"]
 logger.info(f"years: {years}\n")
 
@@ -77,22 +99,40 @@ zip_codes = locs["zipcodes"]
 logger.info(f"zip codes: {zip_codes}\n")
 
 
+# report from a read-only connection, before anything is created or seeded
+if args.pending:
+    manifest = {}
+    if os.path.exists(db1_path + db1_file):
+        conn = sqlite3.connect(f"file:{db1_path + db1_file}?mode=ro", uri=True)
+        manifest = nsrdb_manifest.peek_manifest(conn)
+        conn.close()
+    pending = nsrdb_manifest.get_pending(None, list(zip_codes.keys()), years, manifest=manifest)
+    for zip_code, year in pending:
+        print(zip_code, year)
+    print(f"pending: {len(pending)} of {len(zip_codes) * len(years)} zip-years")
+    exit(0)
+
 # establish db connection and cursor
 conn = sqlite3.connect(db1_path + db1_file)
 cursor = conn.cursor()
 
 cursor.execute(queries.create_table_nsrdb)
 conn.commit()
+nsrdb_migrate.migrate(conn)
 cursor.execute(queries.create_table_geo_zipcodes)
 conn.commit()
 
+# the manifest is consulted before any request so a restart resumes
+# where the previous run stopped
+nsrdb_manifest.create_manifest(conn)
+pending = nsrdb_manifest.get_pending(conn, list(zip_codes.keys()), years)
+
 conn2 = sqlite3.connect(db2_path + db2_file)
 cursor2 = conn2.cursor()
 
-# need to test for existance of records in the db
-# and skip the import if so
-# for now...
-if zip_import:
+# only import the zip code table on the first run against this db
+cursor.execute(queries.select_gzc_count)
+if zip_import and cursor.fetchone()[0] == 0:
     cursor.execute("""ATTACH DATABASE '../data/db/geo_zipcodes.db' AS gzc_db;""")
     cursor.execute("""INSERT INTO 'geo_zipcodes' SELECT * FROM gzc_db.geo_zipcodes;""")
     conn.commit()
@@ -103,111 +143,128 @@ if zip_import:
 # https://developer.nrel.gov/docs/solar/nsrdb/psm3-download/
 
 
-for year in years:
-    for zip_code in tqdm(zip_codes.keys()):
-        req_str = (
-            f"https://developer.nrel.gov/api/solar/nsrdb_psm3_download.csv?"
-            + f'wkt=POINT({zip_codes[zip_code]["lon"]}%20{zip_codes[zip_code]["lat"]})'
-            + f"&names={year}"
-            + f'&leap_day={cfg_vars["leap_year"]}'
-            + f'&interval={cfg_vars["interval"]}'
-            + f'&utc={cfg_vars["utc"]}'
-            + f'&full_name={cfg_vars["name"]}'
-            + f'&email={cfg_vars["email"]}'
-            + f'&affiliation={cfg_vars["affiliation"]}'
-            + f'&mailing_list={cfg_vars["mailing_list"]}'
-            + f'&reason={cfg_vars["use"]}'
-            + f'&api_key={nrel_key}'
-            + f'&attributes={cfg_vars["attrs"]}'
-        )
+def process_download(job, text):
+    """parse one PSM3 response, write the raw csv files and load the database"""
+    year = job["year"]
+    zip_code = job["zipcode"]
 
-        logger.info(f"{req_str}\n")
+    df_meta, df_data = psm3_parser.read_psm3(text, nrows=nrows)
+    logger.info(f"{zip_code}, {year} request successful.")
 
-        # sleep so we don't overrun the rate NREL limit
-        sleep(2)
-        try:
-            df_raw = pd.read_csv(req_str, nrows=nrows)
-            logger.info("reg_str successful.")
-        except:
-            logger.error(f"Error requesting\n{req_str}\n")
-
-        # query and extract the first 2 lines to get metadata:
-        df_meta = df_raw.iloc[0].copy()
-        # display(df_meta)
-
-        row1_cols = df_raw.iloc[1]
-        new_header = [item.replace(" ", "_") if isinstance(item, str) else item for item in row1_cols]
-
-        df_data = df_raw.iloc[1:].copy()
-        df_data.columns = new_header
-        df_data.drop(1, axis=0, inplace=True)
-        df_data = df_data.loc[:, df_data.columns.notnull()].copy()
-        df_data.reset_index(drop=True, inplace=True)
-
-        df_data.insert(0, "date_time", "")
-
-        df_data["date_time"] = pd.to_datetime(
-            df_data["Year"].astype(str)
-            + "-"
-            + df_data["Month"].astype(str)
-            + "-"
-            + df_data["Day"].astype(str)
-            + " "
-            + df_data["Hour"].astype(str)
-            + ":"
-            + df_data["Minute"].astype(str)
-            + ":"
-            + "00"
-        )
+    df_data = psm3_parser.to_nsrdb_frame(df_meta, df_data, zip_code)
 
-        # df_data.drop(["Year", "Month", "Day", "Hour", "Minute"], axis=1, inplace=True)
-        df_data.drop(["Minute"], axis=1, inplace=True)
-        df_data.insert(1, "zipcode", zip_code)
-        df_data.insert(2, "location_id", df_meta["Location ID"])
+    data_names = [
+        (df_data, "nsrdb_" + str(zip_code) + "_" + str(year) + ".csv"),
+        (df_meta, "nsrdb_meta_" + str(zip_code) + "_" + str(year) + ".csv"),
+    ]
 
-        data_names = [
-            (df_data, "nsrdb_" + str(zip_code) + "_" + str(year) + ".csv"),
-            (df_meta, "nsrdb_meta_" + str(zip_code) + "_" + str(year) + ".csv"),
-        ]
+    try:
+        for item in data_names:
+            item[0].to_csv(raw_path + item[1], index=True)
+            logger.info(f"{item[1]} successfully written.\n")
+    except:
+        logger.error("Error writing .csv raw file(s)")
 
+    if storage_cfg["write_parquet"]:
         try:
-            for item in data_names:
-                item[0].to_csv(raw_path + item[1], index=True)
-                logger.info(f"{item[1]} successfully written.\n")
+            cursor.execute(queries.select_locale_data, {"zipcode": zip_code})
+            locale = cursor.fetchone()
+            parquet_store.write_partition(
+                df_data,
+                parquet_store.get_dataset_root(storage_cfg["parquet_path"], db1_file),
+                locale[2] if locale else state,
+                zip_code,
+                year,
+            )
         except:
-            logger.error("Error writing .csv raw file(s)")
+            logger.error("Error writing parquet partition")
+
+    try:
+        # clear any partial load of this zip-year left by an interrupted run
+        stats = bulk_loader.bulk_insert(
+            conn,
+            db_table1,
+            df_data,
+            pre_statements=[(queries.delete_zip_year, {"zipcode": zip_code, "year": year})],
+        )
+        bulk_loader.add_stats(load_totals, stats)
+        loaded_zips.add(zip_code)
+        loaded_zip_years.add((zip_code, year))
+        nsrdb_manifest.mark_status(
+            conn,
+            zip_code,
+            year,
+            nsrdb_manifest.status_done,
+            row_count=len(df_data),
+            checksum=nsrdb_manifest.get_checksum(text),
+        )
+        logger.info(f"data for {year}, {zip_code} written to {db1_file}:{db_table1}\n")
+    except:
+        conn.rollback()
+        nsrdb_manifest.mark_status(conn, zip_code, year, nsrdb_manifest.status_failed)
+        logger.error("Error writing to nsrdb\n")
+        # run_downloads counts it as a failure, the next run retries the year
+        raise
+
+    llltze_params = {
+        "loc_id": df_meta["Location ID"],
+        "lat": df_meta["Latitude"],
+        "lon": df_meta["Longitude"],
+        "elev": df_meta["Elevation"],
+        "tz": df_meta["Time Zone"],
+        "zipcode": zip_code,
+    }
+    logger.info(f"{llltze_params}\n")
+
+    cursor.execute(queries.update_gzc_llltze, llltze_params)
+    conn.commit()
 
-        try:
-            cursor.execute(queries.select_zip_year, {"zipcode": zip_code, "year": year})
-            count = cursor.fetchone()
-            # logger.info(count)
-
-            if (count[0] == "8760") or (count[0] == "8784"):
-                logger.warning(f"data for {year}, {zip_code} already present\n")
-            else:
-                df_data.to_sql("nsrdb", conn, if_exists="append", index=False, method="multi")
-                logger.info(f"data for {year}, {zip_code} written to {db_file}:{db_table1}\n")
-        except:
-            logger.error("Error writing to nsrdb\n")
-
-        llltze_params = {
-            "loc_id": df_meta["Location ID"],
-            "lat": df_meta["Latitude"],
-            "lon": df_meta["Longitude"],
-            "elev": df_meta["Elevation"],
-            "tz": df_meta["Time Zone"],
-            "zipcode": zip_code,
-        }
-        logger.info(f"{llltze_params}\n")
-
-        cursor.execute(queries.update_gzc_llltze, llltze_params)
-        conn.commit()
-
-        cursor2.execute(queries.update_gzc_llltze, llltze_params)
-        conn2.commit()
-
-        cursor.execute(queries.select_zipcode, {"zipcode": zip_code})
-        logger.info(f"gzc: {cursor.fetchall()}\n")
+    cursor2.execute(queries.update_gzc_llltze, llltze_params)
+    conn2.commit()
+
+    cursor.execute(queries.select_zipcode, {"zipcode": zip_code})
+    logger.info(f"gzc: {cursor.fetchall()}\n")
+
+
+# requests are issued concurrently under a token bucket sized to the
+# NREL rate limit (config.yml -> download_scheduler), responses are
+# handled one at a time in this thread
+jobs = [
+    {
+        "zipcode": zip_code,
+        "year": year,
+        "url": nsrdb_scheduler.build_request_url(
+            sched_cfg["base_url"],
+            cfg_vars,
+            nrel_key,
+            zip_codes[zip_code]["lon"],
+            zip_codes[zip_code]["lat"],
+            year,
+        ),
+    }
+    for zip_code, year in pending
+]
+logger.info(f"{len(jobs)} requests scheduled\n")
+
+loaded_zips = set()
+loaded_zip_years = set()
+
+with bulk_loader.load_session(
+    conn,
+    wal=load_cfg["wal"],
+    synchronous_off=load_cfg["synchronous_off"],
+    defer_indexes_on=[db_table1] if load_cfg["defer_indexes"] else [],
+) as load_totals:
+    handled, failures = nsrdb_scheduler.run_downloads(jobs, process_download, sched_cfg)
+
+for job, err in failures:
+    logger.error(f"failed: {job['zipcode']}, {job['year']}: {err}")
+    nsrdb_manifest.mark_status(conn, job["zipcode"], job["year"], nsrdb_manifest.status_failed)
+print(f"downloads handled: {handled}, failed: {len(failures)}")
+
+# after the session so the refresh runs against the rebuilt index
+zip_catalog.refresh(conn, sorted(loaded_zips))
+nsrdb_rollup.refresh(conn, sorted(loaded_zip_years), interval_minutes=int(cfg_vars["interval"]))
 
 
 conn.close()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# compact dtype plan for nsrdb frames, applied when PSM3 text and raw csv
+# files are parsed (psm3_parser), when frames are written (bulk_loader) and
+# when the dashboard reads them (ts_tools):
+#   measures           float32 (~7 significant digits, NSRDB publishes 0-4 decimals)
+#   year               int16
+#   month/day/hour/min uint8
+#   cloud type, fill   int8 (PSM3 uses negative codes for missing)
+#   location_id        int32
+#   zipcode            category
+# column names match case-insensitively, so the PSM3 (Year), raw csv and
+# SQLite (year) spellings share one plan
+#
+# memory saved by the plan on one zip code, rollups included when present:
+#   python nsrdb_dtypes.py ../data/db/nsrdb_monthly.db 85286
+
+import argparse
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("../source")
+import nsrdb_rollup
+
+measure_dtype = "float32"
+
+column_dtypes = {
+    "year": "int16",
+    "month": "uint8",
+    "day": "uint8",
+    "hour": "uint8",
+    "minute": "uint8",
+    "cloud_type": "int8",
+    "fill_flag": "int8",
+    "location_id": "int32",
+    "zipcode": "category",
+}
+
+# float measures of a PSM3 download / raw csv / nsrdb row and the decimals
+# NSRDB publishes them with; float32 keeps every one of them at the
+# magnitudes these measures reach
+measure_decimals = {
+    "Temperature": 1,
+    "Clearsky_DHI": 0,
+    "Clearsky_DNI": 0,
+    "Clearsky_GHI": 0,
+    "Dew_Point": 1,
+    "DHI": 0,
+    "DNI": 0,
+    "GHI": 0,
+    "Relative_Humidity": 2,
+    "Solar_Zenith_Angle": 2,
+    "Surface_Albedo": 3,
+    "Pressure": 1,
+    "Precipitable_Water": 3,
+    "Wind_Direction": 1,
+    "Wind_Speed": 1,
+    "Global_Horizontal_UV_Irradiance_(280-400nm)": 4,
+    "Global_Horizontal_UV_Irradiance_(295-385nm)": 4,
+}
+
+measure_columns = list(measure_decimals)
+
+# the aggregated database's names for the UV measures (nsrdb_aggregate.rename_cols)
+measure_aliases = {
+    "GHI_UV_wd": "Global_Horizontal_UV_Irradiance_(280-400nm)",
+    "GHI_UV_nw": "Global_Horizontal_UV_Irradiance_(295-385nm)",
+}
+
+# frames planned by this process and their bytes before / after, for /stats
+_stats = {"frames": 0, "bytes_before": 0, "bytes_after": 0}
+_lock = threading.Lock()
+
+
+def get_dtype(column, dtype=None):
+    """planned dtype of a column, measures by their current float dtype; None: leave as is"""
+    planned = column_dtypes.get(str(column).lower())
+    if planned is not None:
+        return planned
+    if dtype is not None and pd.api.types.is_float_dtype(dtype):
+        return measure_dtype
+    return None
+
+
+def get_parse_dtypes(columns, measures=()):
+    """read_csv dtype mapping: planned columns, measure_dtype for the measures"""
+    dtypes = {col: column_dtypes[col.lower()] for col in columns if col.lower() in column_dtypes}
+    dtypes.update({col: measure_dtype for col in measures if col not in dtypes})
+    return dtypes
+
+
+def is_measure(column):
+    return column in measure_decimals or column in measure_aliases
+
+
+def get_decimals(column):
+    """decimals NSRDB publishes a measure with"""
+    return measure_decimals[measure_aliases.get(column, column)]
+
+
+def get_memory(df):
+    """bytes of a frame, object columns counted deep"""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def apply_plan(df, columns=None):
+    """
+    input: DataFrame, optional subset of its columns
+    functionality: downcast every column with a planned dtype that it does
+                   not already have; integer columns holding NaN stay float
+    return: the planned DataFrame (a new frame when anything changed)
+    """
+    changes = {}
+    for col in df.columns if columns is None else columns:
+        dtype = get_dtype(col, df[col].dtype)
+        if dtype is None or str(df[col].dtype) == dtype:
+            continue
+        if dtype != "category" and dtype != measure_dtype and df[col].isna().any():
+            dtype = measure_dtype
+        changes[col] = dtype
+
+    if not changes:
+        return df
+
+    before = get_memory(df)
+    df = df.astype(changes)
+    with _lock:
+        _stats["frames"] += 1
+        _stats["bytes_before"] += before
+        _stats["bytes_after"] += get_memory(df)
+
+    return df
+
+
+def to_float64(values, decimals):
+    """
+    float32 values of a measure widened to the float64 of their published
+    decimals (21.3 stays 21.3, not 21.299999237)
+    """
+    return np.asarray(values, dtype=np.float32).astype(np.float64).round(decimals)
+
+
+def widen(df):
+    """float32 measure columns of a frame back to the float64 of their decimals"""
+    changes = {
+        col: to_float64(df[col].to_numpy(), get_decimals(col))
+        for col in df.columns
+        if is_measure(col) and df[col].dtype == np.float32
+    }
+    return df.assign(**changes) if changes else df
+
+
+def memory_report(before, after):
+    """
+    input: a frame as loaded and the same frame after apply_plan
+    return: DataFrame of dtype and bytes per column before and after,
+            with a total row and the percentage saved
+    """
+    report = pd.DataFrame(
+        {
+            "dtype_before": before.dtypes.astype(str),
+            "dtype_after": after.dtypes.astype(str),
+            "bytes_before": before.memory_usage(index=False, deep=True),
+            "bytes_after": after.memory_usage(index=False, deep=True),
+        }
+    )
+    report.loc["total"] = ["", "", get_memory(before), get_memory(after)]
+    report["saved_pct"] = (100 * (1 - report["bytes_after"] / report["bytes_before"])).round(1)
+    return report
+
+
+def stats():
+    with _lock:
+        saved = _stats["bytes_before"] - _stats["bytes_after"]
+        return dict(_stats, bytes_saved=saved)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="memory saved by the nsrdb dtype plan on one zip code")
+    parser.add_argument("db_file", help="nsrdb database")
+    parser.add_argument("zipcode")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_file)
+    cursor = conn.cursor()
+    cursor.execute("select name from sqlite_master where type = 'table';")
+    names = {row[0] for row in cursor.fetchall()}
+    tables = ["nsrdb"] + [level["table"] for level in nsrdb_rollup.rollup_levels.values()]
+
+    for table in [table for table in tables if table in names]:
+        df = pd.read_sql(
+            f"select * from {table} where zipcode = :zipcode;",
+            conn,
+            params={"zipcode": args.zipcode},
+            parse_dates=["date_time"],
+        )
+        if df.empty:
+            continue
+        report = memory_report(df, apply_plan(df))
+        print(f"\n{table}: {len(df)} rows\n{report.to_string()}")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
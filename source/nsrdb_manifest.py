@@ -0,0 +1,89 @@
+# persistent record of which (zipcode, year) downloads are complete,
+# consulted before any request is made so an interrupted run resumes
+# where it stopped; see ./nsrdb_download.py
+
+import hashlib
+import sqlite3
+
+from logzero import logger
+
+import queries
+
+
+status_done = "done"
+status_failed = "failed"
+
+
+def create_manifest(conn):
+    """create the manifest table and back-fill it from already loaded years"""
+    cursor = conn.cursor()
+    cursor.execute(queries.create_table_download_manifest)
+    cursor.execute(queries.seed_manifest_from_nsrdb)
+    conn.commit()
+    logger.info(f"manifest seeded with {cursor.rowcount} existing zip-years")
+
+
+def get_checksum(text):
+    """sha256 of the raw response body"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def mark_status(conn, zipcode, year, status, row_count=None, checksum=None, commit=True):
+    cursor = conn.cursor()
+    cursor.execute(
+        queries.upsert_manifest,
+        {
+            "zipcode": str(zipcode),
+            "year": int(year),
+            "status": status,
+            "row_count": row_count,
+            "checksum": checksum,
+        },
+    )
+    if commit:
+        conn.commit()
+
+
+def get_manifest(conn):
+    """manifest rows keyed by (zipcode, year)"""
+    cursor = conn.cursor()
+    cursor.execute(queries.select_manifest)
+    return {(row[0], row[1]): row[2:] for row in cursor.fetchall()}
+
+
+def peek_manifest(conn):
+    """
+    the manifest create_manifest would leave, read without writing: a
+    missing manifest table reads as empty, complete years in nsrdb as done
+    """
+    cursor = conn.cursor()
+    cursor.execute("select name from sqlite_master where type = 'table';")
+    tables = {row[0] for row in cursor.fetchall()}
+
+    manifest = get_manifest(conn) if "download_manifest" in tables else {}
+    if "nsrdb" in tables:
+        try:
+            cursor.execute(queries.select_complete_zip_years)
+        except sqlite3.OperationalError:
+            # not yet migrated, no year column to seed from
+            return manifest
+        for zipcode, year, row_count in cursor.fetchall():
+            manifest.setdefault((zipcode, year), (status_done, row_count, None, None))
+
+    return manifest
+
+
+def get_pending(conn, zip_codes, years, manifest=None):
+    """(zipcode, year) pairs, in request order, that are not yet complete"""
+    if manifest is None:
+        manifest = get_manifest(conn)
+
+    pending = [
+        (zip_code, year)
+        for year in years
+        for zip_code in zip_codes
+        if manifest.get((str(zip_code), int(year)), (None,))[0] != status_done
+    ]
+    logger.info(f"pending zip-years: {len(pending)} of {len(zip_codes) * len(years)}")
+
+    return pending
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# in-place schema migrations for nsrdb databases (hourly city_state.db and
+# monthly nsrdb_monthly.db alike), versioned through PRAGMA user_version
+#
+# usage:
+#   python nsrdb_migrate.py                       # every .db in the configured paths
+#   python nsrdb_migrate.py ../data/db/okc_ok.db --bench
+
+import argparse
+import glob
+import sqlite3
+import sys
+from time import perf_counter
+
+import logzero
+import yaml
+from logzero import logger
+from yaml import load
+
+sys.path.append("../source")
+import queries
+
+
+def get_version(conn):
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA user_version;")
+    return cursor.fetchone()[0]
+
+
+def has_table(conn, table_name):
+    cursor = conn.cursor()
+    cursor.execute(queries.select_table_exists, {"table_name": table_name})
+    return cursor.fetchone()[0] > 0
+
+
+def migrate_v1(conn):
+    """ISO-normalized date_time text and a (zipcode, date_time) index"""
+    cursor = conn.cursor()
+    cursor.execute(queries.normalize_nsrdb_date_time)
+    logger.info(f"date_time values normalized: {cursor.rowcount}")
+    cursor.execute(queries.create_index_nsrdb)
+    cursor.execute("ANALYZE nsrdb;")
+
+
+def migrate_v2(conn):
+    """zip_catalog table built from the existing nsrdb rows"""
+    cursor = conn.cursor()
+    cursor.execute(queries.create_table_zip_catalog)
+    cursor.execute(queries.create_table_geo_zipcodes)
+    cursor.execute(queries.refresh_zip_catalog_all)
+    logger.info(f"zip catalog rows: {cursor.rowcount}")
+
+
+# (version, function) pairs applied in order to databases below that version
+migrations = [
+    (1, migrate_v1),
+    (2, migrate_v2),
+]
+
+
+def migrate(conn):
+    """bring the nsrdb schema up to queries.nsrdb_schema_version, return the version"""
+    version = get_version(conn)
+    if not has_table(conn, "nsrdb"):
+        return version
+
+    if conn.in_transaction:
+        conn.commit()
+
+    for target, migration in migrations:
+        if version >= target or target > queries.nsrdb_schema_version:
+            continue
+
+        start = perf_counter()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("begin;")
+            migration(conn)
+            # PRAGMA does not accept bound parameters
+            cursor.execute(f"PRAGMA user_version = {int(target)};")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+        logger.info(f"migrated to v{target} in {perf_counter() - start:0.1f}s")
+        version = target
+
+    # restore the index an interrupted load_session left dropped
+    if version >= 1:
+        conn.cursor().execute(queries.create_index_nsrdb)
+        conn.commit()
+
+    return version
+
+
+def time_zip_query(conn, repeat=3):
+    """best-of-`repeat` seconds for the dashboard's irradiance query on the first zip code"""
+    cursor = conn.cursor()
+    cursor.execute("select zipcode from nsrdb limit 1;")
+    row = cursor.fetchone()
+    if row is None:
+        return None
+
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        cursor.execute(queries.select_nsr_rows, {"zipcode": row[0]})
+        cursor.fetchall()
+        timings.append(perf_counter() - start)
+
+    return min(timings)
+
+
+def get_db_files(configs):
+    """every nsrdb database in the configured download and data paths"""
+    paths = [configs["file_paths"]["downloads_path_db"], configs["file_paths"]["db_path"]]
+    gzc_file = configs["file_names"]["db_file_gzc"]
+
+    return sorted(
+        file for path in paths for file in glob.glob(path + "*.db") if not file.endswith(gzc_file)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="migrate nsrdb databases to the current schema")
+    parser.add_argument("db_files", nargs="*", help="database files, default: all configured")
+    parser.add_argument("--bench", action="store_true", help="time the irradiance query before and after")
+    args = parser.parse_args()
+
+    log_path = "logs/"
+    log_file = "nsrdb_migrate.log"
+    logzero.logfile(log_path + log_file, maxBytes=1e5, backupCount=5, disableStderrLogger=True)
+
+    try:
+        with open("../source/config.yml", "r") as config_in:
+            configs = load(config_in, Loader=yaml.SafeLoader)
+    except:
+        logger.error(f"config file open failure.")
+        exit(1)
+
+    db_files = args.db_files or get_db_files(configs)
+
+    for db_file in db_files:
+        conn = sqlite3.connect(db_file)
+        before = time_zip_query(conn) if args.bench else None
+
+        version = get_version(conn)
+        new_version = migrate(conn)
+        print(f"{db_file}: v{version} -> v{new_version}")
+
+        if args.bench and before is not None:
+            after = time_zip_query(conn)
+            print(f"  select_nsr_rows: {before:0.3f}s -> {after:0.3f}s ({before / after:0.1f}x)")
+
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
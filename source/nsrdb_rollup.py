@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# daily / monthly / yearly rollups of an hourly nsrdb database, computed in
+# SQLite from the year, month and day columns (no raw csv files needed)
+#
+# nsrdb_daily, nsrdb_monthly, nsrdb_yearly: one row per zipcode x period with
+#   date_time   period label as pandas resample gives it (day, month end, year end)
+#   n_rows      hourly rows aggregated
+#   <feature>   mean of every queries.nsr_row_columns feature
+#   <irr>_kwh   irradiance energy total in kWh/m^2 (sum of W/m^2 x hours per row)
+#
+# usage:
+#   python nsrdb_rollup.py ../data/db/okc_ok.db                      # every zip-year
+#   python nsrdb_rollup.py ../data/db/okc_ok.db --zipcodes 73008 --years 2019 2020
+
+import argparse
+import sqlite3
+import sys
+from time import perf_counter
+
+import logzero
+from logzero import logger
+
+sys.path.append("../source")
+import queries
+
+
+irradiance_columns = ["Clearsky_DHI", "DHI", "Clearsky_DNI", "DNI", "Clearsky_GHI", "GHI"]
+
+# group columns and date_time label of each rollup table
+rollup_levels = {
+    "daily": {
+        "table": "nsrdb_daily",
+        "group": ["year", "month", "day"],
+        "date_time": "printf('%04d-%02d-%02d 00:00:00', year, month, day)",
+    },
+    "monthly": {
+        "table": "nsrdb_monthly",
+        "group": ["year", "month"],
+        "date_time": "date(printf('%04d-%02d-01', year, month), '+1 month', '-1 day') || ' 00:00:00'",
+    },
+    "yearly": {
+        "table": "nsrdb_yearly",
+        "group": ["year"],
+        "date_time": "printf('%04d-12-31 00:00:00', year)",
+    },
+}
+
+
+def get_create_sql(level):
+    cfg = rollup_levels[level]
+    columns = (
+        ["'zipcode' CHAR(10) NOT NULL", "'date_time' TEXT NOT NULL"]
+        + [f"'{col}' INTEGER" for col in cfg["group"]]
+        + ["'n_rows' INTEGER"]
+        + [f"'{col}' FLOAT" for col in queries.nsr_row_columns]
+        + [f"'{col}_kwh' FLOAT" for col in irradiance_columns]
+        + ["PRIMARY KEY ('zipcode', 'date_time')"]
+    )
+    return f"create table if not exists {cfg['table']}(\n" + ",\n".join(columns) + ");"
+
+
+def get_refresh_sql(level):
+    """insert ... select of one zip-year, hourly rows found through idx_nsrdb_zipcode_date_time"""
+    cfg = rollup_levels[level]
+    group = ", ".join(cfg["group"])
+    names = (
+        ["zipcode", "date_time"]
+        + cfg["group"]
+        + ["n_rows"]
+        + queries.nsr_row_columns
+        + [f"{col}_kwh" for col in irradiance_columns]
+    )
+    values = (
+        ["zipcode", cfg["date_time"]]
+        + cfg["group"]
+        + ["count(*)"]
+        + [f"avg({col})" for col in queries.nsr_row_columns]
+        + [f"sum({col}) * :hours / 1000.0" for col in irradiance_columns]
+    )
+    return (
+        f"insert into {cfg['table']}({', '.join(names)})\n"
+        + f"select {', '.join(values)}\n"
+        + "from nsrdb\n"
+        + "where zipcode = :zipcode and date_time >= :start and date_time < :end\n"
+        + f"group by zipcode, {group};"
+    )
+
+
+def get_delete_sql(level):
+    return f"delete from {rollup_levels[level]['table']} where zipcode = :zipcode and year = :year;"
+
+
+def create_rollups(conn, levels=tuple(rollup_levels)):
+    cursor = conn.cursor()
+    for level in levels:
+        cursor.execute(get_create_sql(level))
+    conn.commit()
+
+
+def get_zip_years(conn, zipcodes=None, years=None):
+    """(zipcode, year) pairs present in nsrdb, optionally filtered"""
+    cursor = conn.cursor()
+    cursor.execute(queries.select_nsrdb_zip_years)
+    return [
+        (zipcode, year)
+        for zipcode, year in cursor.fetchall()
+        if (not zipcodes or zipcode in zipcodes) and (not years or year in years)
+    ]
+
+
+def refresh(conn, zip_years=None, levels=tuple(rollup_levels), interval_minutes=60):
+    """
+    input: sqlite3 connection to an hourly database, iterable of (zipcode, year)
+           pairs (None: every zip-year in nsrdb), rollup levels, minutes per row
+    functionality: recompute the rollup rows of each zip-year, one
+                   transaction per zip-year so readers never see it half done
+    return: dict of zip-years refreshed, rollup rows written and seconds
+    """
+    create_rollups(conn, levels)
+    if zip_years is None:
+        zip_years = get_zip_years(conn)
+
+    refresh_sql = {level: get_refresh_sql(level) for level in levels}
+    delete_sql = {level: get_delete_sql(level) for level in levels}
+
+    start = perf_counter()
+    rows = 0
+    cursor = conn.cursor()
+    for zipcode, year in zip_years:
+        year = int(year)
+        params = {
+            "zipcode": str(zipcode),
+            "year": year,
+            "start": f"{year:04d}-01-01",
+            "end": f"{year + 1:04d}-01-01",
+            "hours": interval_minutes / 60,
+        }
+        try:
+            if not conn.in_transaction:
+                cursor.execute("begin;")
+            for level in levels:
+                cursor.execute(delete_sql[level], params)
+                cursor.execute(refresh_sql[level], params)
+                rows += cursor.rowcount
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+    stats = {"zip_years": len(zip_years), "rows": rows, "seconds": perf_counter() - start}
+    logger.info(f"rollups refreshed: {stats}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="daily/monthly/yearly rollups of an hourly nsrdb database")
+    parser.add_argument("db_file", help="hourly nsrdb database")
+    parser.add_argument("--zipcodes", nargs="+", help="default: every zip code")
+    parser.add_argument("--years", nargs="+", type=int, help="default: every year")
+    parser.add_argument("--levels", nargs="+", choices=list(rollup_levels), default=list(rollup_levels))
+    parser.add_argument("--interval", type=int, default=60, help="minutes per nsrdb row")
+    args = parser.parse_args()
+
+    log_path = "logs/"
+    log_file = "nsrdb_rollup.log"
+    logzero.logfile(log_path + log_file, maxBytes=1e5, backupCount=5, disableStderrLogger=True)
+
+    conn = sqlite3.connect(args.db_file, timeout=60)
+    zip_years = get_zip_years(conn, args.zipcodes, args.years)
+    stats = refresh(conn, zip_years, levels=args.levels, interval_minutes=args.interval)
+    conn.close()
+
+    print(f"{args.db_file}: {stats['zip_years']} zip-years, {stats['rows']} rollup rows, {stats['seconds']:0.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# concurrent, rate-limited request scheduler for the NREL PSM3 download API
+# see ./nsrdb_download.py for usage and ./config.yml -> download_scheduler for settings
+
+import random
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from logzero import logger
+from tqdm import tqdm
+
+
+# https://developer.nrel.gov/docs/rate-limits/
+# 429 is returned once the hourly/per-second limit is exceeded,
+# 503 is returned by the gateway when the service is saturated
+throttle_codes = (429, 503)
+
+scheduler_defaults = {
+    "base_url": "https://developer.nrel.gov/api/solar/nsrdb_psm3_download.csv",
+    "max_workers": 4,
+    "rate_per_sec": 0.5,
+    "burst": 1,
+    "max_retries": 5,
+    "backoff_base": 2.0,
+    "backoff_max": 120.0,
+    "timeout": 120,
+}
+
+
+class TokenBucket:
+    """thread-safe token bucket, acquire() blocks until a request may be issued"""
+
+    def __init__(self, rate_per_sec, burst=1):
+        self.rate = float(rate_per_sec)
+        self.capacity = max(float(burst), 1.0)
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """hold back every worker for `seconds` after the server throttles us"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+def get_scheduler_config(configs):
+    """merge config.yml -> download_scheduler over the defaults"""
+    sched_cfg = dict(scheduler_defaults)
+    sched_cfg.update(configs.get("download_scheduler") or {})
+    return sched_cfg
+
+
+def build_request_url(base_url, cfg_vars, api_key, lon, lat, year):
+    """assemble the PSM3 download request for one location and year"""
+    return (
+        f"{base_url}?"
+        + f"wkt=POINT({lon}%20{lat})"
+        + f"&names={year}"
+        + f'&leap_day={cfg_vars["leap_year"]}'
+        + f'&interval={cfg_vars["interval"]}'
+        + f'&utc={cfg_vars["utc"]}'
+        + f'&full_name={cfg_vars["name"]}'
+        + f'&email={cfg_vars["email"]}'
+        + f'&affiliation={cfg_vars["affiliation"]}'
+        + f'&mailing_list={cfg_vars["mailing_list"]}'
+        + f'&reason={cfg_vars["use"]}'
+        + f"&api_key={api_key}"
+        + f'&attributes={cfg_vars["attrs"]}'
+    )
+
+
+def get_backoff(attempt, sched_cfg, retry_after=None):
+    """seconds to wait before the next attempt, honoring Retry-After when sent"""
+    if retry_after:
+        try:
+            return min(float(retry_after), sched_cfg["backoff_max"])
+        except ValueError:
+            pass
+
+    delay = sched_cfg["backoff_base"] ** attempt
+    # full jitter keeps the workers from retrying in lock-step
+    return min(delay, sched_cfg["backoff_max"]) * (0.5 + random.random() / 2)
+
+
+def fetch_csv(url, bucket, sched_cfg):
+    """request a single PSM3 csv, retrying with backoff on throttling and transient errors"""
+    max_retries = sched_cfg["max_retries"]
+
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        try:
+            with urllib.request.urlopen(url, timeout=sched_cfg["timeout"]) as response:
+                return response.read().decode("utf-8")
+
+        except urllib.error.HTTPError as err:
+            if err.code not in throttle_codes and err.code < 500:
+                raise
+            if attempt == max_retries:
+                raise
+            delay = get_backoff(attempt + 1, sched_cfg, err.headers.get("Retry-After"))
+            logger.warning(f"HTTP {err.code}, backing off {delay:0.1f}s (attempt {attempt + 1})")
+            # the next acquire() waits out the penalty, no sleep of our own
+            bucket.penalize(delay)
+
+        # socket.timeout is not a TimeoutError before Python 3.10 (read stalls)
+        except (urllib.error.URLError, socket.timeout, TimeoutError, ConnectionError) as err:
+            if attempt == max_retries:
+                raise
+            delay = get_backoff(attempt + 1, sched_cfg)
+            logger.warning(f"{err}, retrying in {delay:0.1f}s (attempt {attempt + 1})")
+            time.sleep(delay)
+
+
+def run_downloads(jobs, handler, sched_cfg):
+    """
+    input: list of job dicts, each carrying at least a "url" key
+           handler(job, text) called for every completed download
+           scheduler configuration (see get_scheduler_config)
+    functionality: fetch all jobs on a bounded thread pool under a shared
+                   token bucket; the handler runs in the calling thread so
+                   database writes stay single-threaded
+    return: number of handled jobs, list of (job, exception) failures
+    """
+    bucket = TokenBucket(sched_cfg["rate_per_sec"], sched_cfg["burst"])
+    handled = 0
+    failures = []
+
+    with ThreadPoolExecutor(max_workers=sched_cfg["max_workers"]) as executor:
+        futures = {executor.submit(fetch_csv, job["url"], bucket, sched_cfg): job for job in jobs}
+
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            job = futures[future]
+            try:
+                text = future.result()
+            except Exception as err:
+                logger.error(f"Error requesting\n{job['url']}\n{err}\n")
+                failures.append((job, err))
+                continue
+
+            try:
+                handler(job, text)
+                handled += 1
+            except Exception as err:
+                logger.exception(f"Error handling {job}: {err}")
+                failures.append((job, err))
+
+    logger.info(f"downloads handled: {handled}, failed: {len(failures)}")
+
+    return handled, failures
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# local stand-in for the NREL PSM3 download endpoint, serving the example
+# files in ../data/examples_nrel/ re-assembled into the raw PSM3 csv layout.
+#
+# usage:
+#   python nsrdb_standin.py --port 8642 --throttle-every 5
+# then point config.yml -> download_scheduler -> base_url at
+#   http://127.0.0.1:8642/api/solar/nsrdb_psm3_download.csv
+
+import argparse
+import glob
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from psm3_parser import build_psm3_text
+
+
+examples_path = "../data/examples_nrel/"
+
+
+def get_example_files(data_path, year):
+    """first example data/meta file pair found for the requested year"""
+    data_files = sorted(glob.glob(f"{data_path}nsrdb_?????_{year}.csv"))
+    if not data_files:
+        return None, None
+
+    data_file = data_files[0]
+    meta_file = f"{data_path}nsrdb_meta_{os.path.basename(data_file)[6:]}"
+    return data_file, meta_file
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    throttle_every = 0
+    request_count = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            StandinHandler.request_count += 1
+            count = StandinHandler.request_count
+
+        if self.throttle_every and count % self.throttle_every == 0:
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+            return
+
+        query = parse_qs(urlparse(self.path).query)
+        year = query.get("names", [""])[0]
+        data_file, meta_file = get_example_files(examples_path, year)
+
+        if data_file is None:
+            self.send_error(400, f"no example data for year '{year}'")
+            return
+
+        body = build_psm3_text(data_file, meta_file).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="local stand-in for the NREL PSM3 csv endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8642)
+    parser.add_argument("--throttle-every", type=int, default=0, help="answer every Nth request with HTTP 429")
+    args = parser.parse_args()
+
+    StandinHandler.throttle_every = args.throttle_every
+    server = ThreadingHTTPServer((args.host, args.port), StandinHandler)
+    print(f"serving {examples_path} on http://{args.host}:{args.port}/")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
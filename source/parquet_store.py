@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# optional columnar storage for irradiance data: hive-partitioned parquet,
+# <parquet_path>/<db name>/state=<st>/zipcode=<zip>/year=<yyyy>/part-0.parquet
+# written by nsrdb_download.py (config.yml -> storage -> write_parquet) and
+# read by ts_tools.get_irr_data when config.yml -> storage -> backend is "parquet"
+#
+# export an existing database:
+#   python parquet_store.py ../data/db/nsrdb_monthly.db
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+import yaml
+from logzero import logger
+from yaml import load
+
+sys.path.append("../source")
+import nsrdb_dtypes
+import queries
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+def check_pyarrow():
+    if pa is None:
+        raise ImportError("the parquet storage backend requires pyarrow (pip install pyarrow)")
+
+
+def get_partitioning():
+    # explicit types so zip codes keep their leading zeros
+    return ds.partitioning(
+        pa.schema([("state", pa.string()), ("zipcode", pa.string()), ("year", pa.int32())]),
+        flavor="hive",
+    )
+
+
+# time components as SQLite names them (PSM3 frames carry Month, Day, Hour)
+time_columns = ["month", "day", "hour", "minute"]
+
+
+def get_column_type(col):
+    """pinned arrow type of a partition column: the nsrdb_dtypes plan, measures float32"""
+    if col == "date_time":
+        return pa.timestamp("ns")
+    return pa.from_numpy_dtype(np.dtype(nsrdb_dtypes.get_dtype(col, "float64")))
+
+
+def get_partition_table(df):
+    """
+    arrow table with the same column names, order and physical types for
+    every writer, download frames (compact dtypes) and export_db (SQLite
+    int64 / float64) alike, since a dataset takes its schema from one file
+    """
+    df = df.rename(columns={col: col.lower() for col in df.columns if col.lower() in time_columns})
+    first = [col for col in ["date_time", "location_id"] + time_columns if col in df.columns]
+    df = df[first + [col for col in df.columns if col not in first]]
+
+    schema = pa.schema([(col, get_column_type(col)) for col in df.columns])
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def get_dataset_root(parquet_path, db_filename):
+    """one dataset per database file, named after it"""
+    return parquet_path + os.path.splitext(os.path.basename(db_filename))[0] + "/"
+
+
+def write_partition(df, root, state, zipcode, year):
+    """write (replace) a single state/zipcode/year partition"""
+    check_pyarrow()
+
+    part_dir = f"{root}state={state}/zipcode={zipcode}/year={int(year)}/"
+    os.makedirs(part_dir, exist_ok=True)
+
+    df = df.drop(columns=[col for col in df.columns if col.lower() in ("zipcode", "year")])
+    table = get_partition_table(df)
+
+    # write then rename so readers never see a partial file
+    tmp_file = part_dir + "part-0.parquet.tmp"
+    pq.write_table(table, tmp_file)
+    os.replace(tmp_file, part_dir + "part-0.parquet")
+    # bump the root so get_dataset_version sees the rewrite
+    os.utime(root)
+    logger.info(f"parquet partition written: {part_dir}")
+
+
+def has_dataset(root):
+    return os.path.isdir(root)
+
+
+def get_dataset_version(root):
+    """root directory mtime, touched by every write_partition; None without a dataset"""
+    try:
+        return os.stat(root).st_mtime_ns
+    except OSError:
+        return None
+
+
+def read_irr_data(root, zipcode, columns, start=None, end=None):
+    """
+    input: dataset root, zip code, list of value columns, optional inclusive
+           start/end Timestamps
+    functionality: read only the requested columns of one zip code, the
+                   zipcode filter and the years of start/end are pushed down
+                   to partition pruning
+    return: DataFrame indexed and sorted by date_time
+    """
+    check_pyarrow()
+
+    row_filter = ds.field("zipcode") == str(zipcode)
+    if start is not None:
+        row_filter = row_filter & (ds.field("year") >= start.year)
+    if end is not None:
+        row_filter = row_filter & (ds.field("year") <= end.year)
+
+    dataset = ds.dataset(root, format="parquet", partitioning=get_partitioning())
+    table = dataset.to_table(columns=["date_time"] + list(columns), filter=row_filter)
+
+    df = table.to_pandas()
+    df["date_time"] = pd.to_datetime(df["date_time"])
+    df.set_index("date_time", inplace=True)
+    df.sort_index(axis=0, inplace=True)
+
+    return df.loc[start:end]
+
+
+def export_db(db_file, parquet_path):
+    """write every zip code / year of a database's nsrdb table to parquet"""
+    check_pyarrow()
+
+    root = get_dataset_root(parquet_path, db_file)
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    cursor.execute(queries.select_distinct_zips)
+    zipcodes = [row[0] for row in cursor.fetchall()]
+
+    for zipcode in zipcodes:
+        cursor.execute(queries.select_locale_data, {"zipcode": zipcode})
+        locale = cursor.fetchone()
+        state = locale[2] if locale else "unknown"
+
+        df = pd.read_sql(
+            "select * from nsrdb where zipcode = :zipcode order by date_time;",
+            conn,
+            params={"zipcode": zipcode},
+        )
+        df.drop(columns=["id"], inplace=True)
+        df["date_time"] = pd.to_datetime(df["date_time"])
+
+        for year, df_year in df.groupby(df["date_time"].dt.year):
+            write_partition(df_year, root, state, zipcode, year)
+
+    conn.close()
+    print(f"{db_file}: {len(zipcodes)} zip codes written to {root}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="export nsrdb databases to partitioned parquet")
+    parser.add_argument("db_files", nargs="+")
+    args = parser.parse_args()
+
+    try:
+        with open("../source/config.yml", "r") as config_in:
+            configs = load(config_in, Loader=yaml.SafeLoader)
+    except:
+        logger.error(f"config file open failure.")
+        exit(1)
+
+    for db_file in args.db_files:
+        export_db(db_file, configs["storage"]["parquet_path"])
+
+
+if __name__ == "__main__":
+    main()
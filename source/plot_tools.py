@@ -1,3 +1,4 @@
+import downsample
 import logzero
 import numpy as np
 import pandas as pd
@@ -28,12 +29,32 @@ except:
     exit(1)
 
 
-def plot_irradiance(df, title="Irradiance Data", zipcode="", irr_columns=[], locale=[]):
+def get_max_points(width_px=None):
+    """points per trace for a plot width_px pixels wide, the configured max_points until measured"""
+    if not width_px:
+        return cfg["downsample"]["max_points"]
+    return int(width_px * cfg["downsample"]["points_per_px"])
+
+
+def get_trace(df, column, max_points, x_range=None):
+    """one column of df, zoomed to x_range and reduced to max_points"""
+    series = downsample.get_window(df, x_range)[column]
+    return downsample.downsample(series, max_points, mode=cfg["downsample"]["mode"])
+
+
+def plot_irradiance(
+    df, title="Irradiance Data", zipcode="", irr_columns=[], locale=[], max_points=None, x_range=None
+):
 
     logger.info(f"plot_data irradiance columns: {irr_columns}")
 
     layout = ts_tools.get_plots_layout(num_columns=2, num_items=len(irr_columns))
 
+    # each subplot gets its share of the plot width
+    if max_points is None:
+        max_points = get_max_points()
+    max_points = max_points // layout["columns"]
+
     fig = make_subplots(
         rows=layout["rows"],
         cols=layout["columns"],
@@ -44,10 +65,11 @@ def plot_irradiance(df, title="Irradiance Data", zipcode="", irr_columns=[], loc
     col_idx = 0
     for _, row in enumerate(range(1, layout["rows"] + 1)):
         for _, col in enumerate(range(1, layout["columns"] + 1)):
+            trace = get_trace(df, irr_columns[col_idx], max_points, x_range)
             fig.add_trace(
                 go.Scatter(
-                    x=df.index,
-                    y=df[irr_columns[col_idx]],
+                    x=trace.index,
+                    y=trace,
                     name=irr_columns[col_idx],
                     line=dict(width=1.5),
                     showlegend=False,
@@ -91,6 +113,8 @@ def plot_irradiance(df, title="Irradiance Data", zipcode="", irr_columns=[], loc
         font=dict(size=10),
         autosize=True,
         height=395,
+        # keep the user's zoom when the zoomed figure replaces this one
+        uirevision=zipcode,
     )
 
     fig.update_xaxes(matches="x")
@@ -98,10 +122,20 @@ def plot_irradiance(df, title="Irradiance Data", zipcode="", irr_columns=[], loc
     return fig
 
 
-def plot_histograms(df, title="", zipcode=""):
-
+def plot_histograms(df, title="", zipcode="", histograms=None):
+    """
+    bar traces of server-side bin counts, histograms is the
+    ts_tools.get_histograms dict, computed from df when not given
+    """
     columns = df.columns.tolist()
 
+    if histograms is None:
+        histograms = {}
+        for column in columns:
+            values = df[column].dropna().to_numpy()
+            edges = ts_tools.get_bin_edges(values, cfg["histogram"]["bins"], cfg["histogram"]["max_bins"])
+            histograms[column] = np.histogram(values, bins=edges)
+
     col_idx = 0
     layout = ts_tools.get_plots_layout(num_columns=4, num_items=len(columns))
 
@@ -114,10 +148,14 @@ def plot_histograms(df, title="", zipcode=""):
 
     for _, row in enumerate(range(1, layout["rows"] + 1)):
         for _, col in enumerate(range(1, layout["columns"] + 1)):
+            counts, edges = histograms[columns[col_idx]]
             fig.add_trace(
-                go.Histogram(
-                    x=df[columns[col_idx]],
+                go.Bar(
+                    x=(edges[:-1] + edges[1:]) / 2,
+                    y=counts,
+                    width=np.diff(edges),
                     name=columns[col_idx],
+                    marker_line_width=0,
                     showlegend=False,
                 ),
                 row=row,
@@ -153,19 +191,23 @@ def plot_histograms(df, title="", zipcode=""):
     return fig
 
 
-def plot_multi_line(df, title="Title", locale=[], columns=[]):
+def plot_multi_line(df, title="Title", locale=[], columns=[], max_points=None, x_range=None):
 
     colors = (("red", 0.75), ("yellow", 0.75), ("green", 0.80), ("blue", 0.90))
     label_text = [label.replace("_", " ") for label in columns]
 
+    if max_points is None:
+        max_points = get_max_points()
+
     fig = go.Figure()
 
     for idx, label in enumerate(columns):
+        trace = get_trace(df, label, max_points, x_range)
         fig.add_trace(
             go.Scatter(
                 name=label_text[idx],
-                x=df.index,
-                y=df[label],
+                x=trace.index,
+                y=trace,
                 mode="lines",
                 line=dict(color=colors[idx][0], width=2),
                 opacity=colors[idx][1],
@@ -206,6 +248,7 @@ def plot_multi_line(df, title="Title", locale=[], columns=[]):
         font=dict(size=10),
         autosize=True,
         height=395,
+        uirevision=str(locale),
     )
 
     fig.update_xaxes(rangeslider_thickness=0.10)
@@ -213,13 +256,14 @@ def plot_multi_line(df, title="Title", locale=[], columns=[]):
     return fig
 
 
-def plot_trends(df, title="", zipcode="", locale=[]):
+def plot_trends(df, title="", zipcode="", locale=[], decomps=None):
 
     cols = df.columns.tolist()
     layout = ts_tools.get_plots_layout(num_columns=1, num_items=len(cols))
     units_text = [value for value in cfg["data_units"].values()]
 
-    decomps = ts_tools.get_data_decomps(df, period=12)
+    if decomps is None:
+        decomps = ts_tools.get_data_decomps(df, period=12)
 
     fig = make_subplots(
         rows=layout["rows"],
@@ -347,3 +391,100 @@ def plot_forecast(train, test, test_pred, forecast, title="", zipcode="", locale
     )
 
     return fig
+
+
+def get_compare_labels(zipcodes, locales):
+    """'zipcode city, state' legend labels, the bare zip code without locale data"""
+    labels = []
+    for zipcode in zipcodes:
+        locale = (locales or {}).get(zipcode)
+        labels.append(f"{zipcode} {locale[0]}, {locale[2]}" if locale else zipcode)
+    return labels
+
+
+def plot_compare_lines(df, title="", feature="", locales=None, max_points=None):
+    """one line per zip code column of a ts_tools.get_multi_zip_data frame"""
+    if max_points is None:
+        max_points = get_max_points()
+
+    fig = go.Figure()
+
+    labels = get_compare_labels(df.columns, locales)
+    for zipcode, label in zip(df.columns, labels):
+        trace = get_trace(df, zipcode, max_points)
+        fig.add_trace(
+            go.Scatter(
+                name=label,
+                x=trace.index,
+                y=trace,
+                mode="lines",
+                line=dict(width=1.5),
+                opacity=0.8,
+                connectgaps=True,
+            )
+        )
+
+    fig.update_layout(
+        title=dict(
+            text=f"{title}: {feature.replace('_', ' ')}, {len(df.columns)} zip codes",
+            font=dict(family="Arial", size=16),
+            xanchor="center",
+            x=0.5,
+        ),
+        yaxis=dict(title_text=cfg["data_units"].get(feature, ""), gridcolor=cfg["COLORS"]["gridcolor_dark"]),
+        xaxis=dict(rangeslider=dict(visible=True), type="date"),
+        margin=dict(l=5, r=5, b=0, t=50, pad=0),
+        plot_bgcolor=cfg["COLORS"]["background"],
+        paper_bgcolor=cfg["COLORS"]["background"],
+        font_color=cfg["COLORS"]["text"],
+        font=dict(size=10),
+        autosize=True,
+        height=450,
+        uirevision=feature,
+    )
+
+    fig.update_xaxes(rangeslider_thickness=0.10)
+
+    return fig
+
+
+def plot_compare_heatmap(df, title="", feature="", locales=None, max_points=None):
+    """zip code x time heatmap of a ts_tools.get_multi_zip_data frame"""
+    if max_points is None:
+        max_points = get_max_points()
+
+    # average blocks of consecutive rows so the x axis stays under max_points cells
+    block = max(int(np.ceil(len(df) / max_points)), 1)
+    if block > 1:
+        groups = np.arange(len(df)) // block
+        df = df.groupby(groups).mean().set_index(df.index[::block])
+
+    fig = go.Figure(
+        go.Heatmap(
+            z=df.to_numpy().T,
+            x=df.index,
+            y=get_compare_labels(df.columns, locales),
+            colorscale="Inferno",
+            colorbar=dict(title=cfg["data_units"].get(feature, "")),
+            hoverongaps=False,
+        )
+    )
+
+    fig.update_layout(
+        title=dict(
+            text=f"{title}: {feature.replace('_', ' ')}",
+            font=dict(family="Arial", size=16),
+            xanchor="center",
+            x=0.5,
+        ),
+        yaxis=dict(tickfont=dict(size=9), autorange="reversed"),
+        margin=dict(l=5, r=5, b=0, t=50, pad=0),
+        plot_bgcolor=cfg["COLORS"]["background"],
+        paper_bgcolor=cfg["COLORS"]["background"],
+        font_color=cfg["COLORS"]["text"],
+        font=dict(size=10),
+        autosize=True,
+        height=max(300, 18 * len(df.columns) + 100),
+    )
+
+    return fig
@@ -89,3 +89,66 @@ def get_arima_auto_model(train, fc_periods):
     model.fit(train)
 
     return model
+
+
+def get_arima_diagnostics(model):
+    """order, seasonal order and information criteria of a fitted (Auto)ARIMA or pipeline"""
+    if hasattr(model, "steps"):
+        model = model.steps[-1][1]
+    # AutoARIMA wraps the selected ARIMA in model_
+    arima_model = getattr(model, "model_", model)
+
+    return {
+        "order": str(arima_model.order),
+        "seasonal_order": str(arima_model.seasonal_order),
+        "aic": float(arima_model.aic()),
+        "bic": float(arima_model.bic()),
+    }
+
+
+# model name -> fitting function, see forecast_feature
+arima_models = {
+    "fft": get_arima_fft_model,
+    "seasonal": get_arima_auto_model,
+}
+
+
+def forecast_feature(df, feature, model_name, test_periods=60, fc_periods=60, store=None, store_key=None):
+    """
+    input: monthly irradiance DataFrame, feature column, arima_models key,
+           number of test months and forecast months, optional
+           model_store.ModelStore and key for reusing the train-split fit
+    functionality: fit on the train split, predict the test split, update the
+                   model with the test data and forecast past the last month
+    return: dict of train, test, test_pred and forecast Series, how the model
+            was obtained (fitted, updated or reused) and its train-split diagnostics
+    """
+    train, test = model_selection.train_test_split(df[feature], test_size=test_periods)
+
+    def fit(train):
+        return arima_models[model_name](train, fc_periods)
+
+    if store is None:
+        model, model_status = fit(train), "fitted"
+    else:
+        model, model_status = store.get_model(store_key, train, fit)
+    logger.info(model)
+    diagnostics = get_arima_diagnostics(model)
+
+    test_pred = model.predict(n_periods=test_periods, return_conf_int=False)
+    test_pred = pd.Series(test_pred, index=test.index)
+
+    model.update(test)
+
+    dt_idx = pd.date_range(df.index[-1], periods=fc_periods + 1, freq=pd.offsets.MonthEnd())[1:]
+    forecast = model.predict(n_periods=fc_periods, return_conf_int=False)
+    forecast = pd.Series(forecast, index=dt_idx)
+
+    return {
+        "train": train,
+        "test": test,
+        "test_pred": test_pred,
+        "forecast": forecast,
+        "model_status": model_status,
+        "diagnostics": diagnostics,
+    }
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# timing comparison of psm3_parser against the previous single-pass,
+# string-concatenated datetime parse (time and frame memory), using the files in ../data/examples_nrel/
+#
+# usage:
+#   python psm3_bench.py --repeat 5
+
+import argparse
+import glob
+import io
+import os
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+import nsrdb_dtypes
+import psm3_parser
+
+
+examples_path = "../data/examples_nrel/"
+
+
+def legacy_parse(text, zip_code, nrows=99999):
+    """the parse previously done inline in nsrdb_download.py"""
+    df_raw = pd.read_csv(io.StringIO(text), nrows=nrows)
+
+    df_meta = df_raw.iloc[0].copy()
+
+    row1_cols = df_raw.iloc[1]
+    new_header = [item.replace(" ", "_") if isinstance(item, str) else item for item in row1_cols]
+
+    df_data = df_raw.iloc[1:].copy()
+    df_data.columns = new_header
+    df_data.drop(1, axis=0, inplace=True)
+    df_data = df_data.loc[:, df_data.columns.notnull()].copy()
+    df_data.reset_index(drop=True, inplace=True)
+
+    df_data.insert(0, "date_time", "")
+
+    df_data["date_time"] = pd.to_datetime(
+        df_data["Year"].astype(str)
+        + "-"
+        + df_data["Month"].astype(str)
+        + "-"
+        + df_data["Day"].astype(str)
+        + " "
+        + df_data["Hour"].astype(str)
+        + ":"
+        + df_data["Minute"].astype(str)
+        + ":"
+        + "00"
+    )
+
+    df_data.drop(["Minute"], axis=1, inplace=True)
+    df_data.insert(1, "zipcode", zip_code)
+    df_data.insert(2, "location_id", df_meta["Location ID"])
+
+    return df_meta, df_data
+
+
+def vectorized_parse(text, zip_code, nrows=99999):
+    df_meta, df_data = psm3_parser.read_psm3(text, nrows=nrows)
+    return df_meta, psm3_parser.to_nsrdb_frame(df_meta, df_data, zip_code)
+
+
+def time_parser(parse, texts, repeat):
+    """best-of-`repeat` seconds to parse every text once"""
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        for zip_code, text in texts:
+            parse(text, zip_code)
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the PSM3 csv parser")
+    parser.add_argument("--path", default=examples_path)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data_files = sorted(glob.glob(args.path + "nsrdb_?????_????.csv"))
+    texts = []
+    for data_file in data_files:
+        name = os.path.basename(data_file)
+        zip_code = name[6:11]
+        meta_file = f"{args.path}nsrdb_meta_{name[6:]}"
+        texts.append((zip_code, psm3_parser.build_psm3_text(data_file, meta_file)))
+
+    # both parses must agree before their timings mean anything
+    _, df_old = legacy_parse(*texts[0][::-1])
+    _, df_new = vectorized_parse(*texts[0][::-1])
+    assert (df_old["date_time"] == df_new["date_time"]).all()
+    assert np.allclose(df_old["GHI"].astype(float), df_new["GHI"])
+
+    t_old = time_parser(legacy_parse, texts, args.repeat)
+    t_new = time_parser(vectorized_parse, texts, args.repeat)
+    rows = sum(len(text.splitlines()) - 3 for _, text in texts)
+
+    print(f"files: {len(texts)}, rows: {rows}, best of {args.repeat}")
+    print(f"legacy:     {t_old:8.3f}s  {rows / t_old:12,.0f} rows/s")
+    print(f"vectorized: {t_new:8.3f}s  {rows / t_new:12,.0f} rows/s")
+    print(f"speed-up:   {t_old / t_new:8.2f}x")
+    print(
+        f"memory:     {nsrdb_dtypes.get_memory(df_old) / 2 ** 20:8.2f} MB -> "
+        + f"{nsrdb_dtypes.get_memory(df_new) / 2 ** 20:0.2f} MB per file"
+    )
+
+
+if __name__ == "__main__":
+    main()
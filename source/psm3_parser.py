@@ -0,0 +1,120 @@
+# parsing for NREL PSM3 csv downloads and the nsrdb_?????_????.csv raw files
+# written from them; shared by nsrdb_download.py and the aggregator notebook
+# see ./psm3_bench.py for a timing comparison against the previous approach
+#
+# PSM3 layout: line 1 metadata names, line 2 metadata values,
+#              line 3 data column names, line 4+ data rows
+
+import csv
+import io
+
+import pandas as pd
+
+import nsrdb_dtypes
+
+
+time_components = ["Year", "Month", "Day", "Hour", "Minute"]
+
+# compact dtypes from ./nsrdb_dtypes.py; columns not listed here are parsed
+# as nsrdb_dtypes.measure_dtype
+psm3_dtypes = nsrdb_dtypes.get_parse_dtypes(time_components + ["Cloud_Type", "Fill_Flag"])
+
+measure_columns = nsrdb_dtypes.measure_columns
+
+raw_dtypes = nsrdb_dtypes.get_parse_dtypes(
+    ["zipcode", "location_id"] + [key for key in psm3_dtypes if key != "Minute"], measure_columns
+)
+
+raw_time_format = "%Y-%m-%d %H:%M:%S"
+
+
+def _open_text(source):
+    """accept response text, a file path or an open text buffer"""
+    if hasattr(source, "read"):
+        return source
+    if "\n" in source:
+        return io.StringIO(source)
+    return open(source, "r", newline="")
+
+
+def read_psm3(source, nrows=None):
+    """
+    input: PSM3 response text, file path or text buffer
+           optional row limit for the data block
+    functionality: read the two metadata lines separately, then parse the
+                   data block with explicit numeric dtypes
+    return: metadata Series, data DataFrame (column spaces -> underscores)
+    """
+    fh = _open_text(source)
+    try:
+        reader = csv.reader(fh)
+        meta_names = next(reader)
+        meta_values = next(reader)
+        df_meta = pd.Series(meta_values[: len(meta_names)], index=meta_names[: len(meta_values)])
+
+        header = [name.replace(" ", "_") for name in next(reader)]
+        df_data = pd.read_csv(
+            fh,
+            header=None,
+            names=header,
+            nrows=nrows,
+            dtype={name: psm3_dtypes.get(name, nsrdb_dtypes.measure_dtype) for name in header},
+        )
+    finally:
+        if fh is not source:
+            fh.close()
+
+    return df_meta, df_data
+
+
+def build_date_time(df):
+    """timestamps assembled from the integer time component columns in one step"""
+    parts = df[[col for col in time_components if col in df.columns]]
+    return pd.to_datetime(parts.rename(columns=str.lower))
+
+
+def to_nsrdb_frame(df_meta, df_data, zipcode):
+    """arrange a parsed PSM3 data block into the nsrdb table / raw csv layout"""
+    df = df_data.copy()
+    df.insert(0, "date_time", build_date_time(df))
+    df.drop(["Minute"], axis=1, inplace=True)
+    dtypes = nsrdb_dtypes.column_dtypes
+    df.insert(1, "zipcode", pd.Series(zipcode, index=df.index, dtype=dtypes["zipcode"]))
+    location_id = int(df_meta["Location ID"])
+    df.insert(2, "location_id", pd.Series(location_id, index=df.index, dtype=dtypes["location_id"]))
+
+    return df
+
+
+def read_raw_csv(path, usecols=None):
+    """read a raw nsrdb_<zipcode>_<year>.csv file with explicit dtypes"""
+    df = pd.read_csv(path, usecols=usecols, dtype=raw_dtypes)
+    df["date_time"] = pd.to_datetime(df["date_time"], format=raw_time_format)
+
+    return df
+
+
+def build_psm3_text(data_file, meta_file):
+    """re-assemble a raw csv / meta csv file pair into the PSM3 download layout"""
+    with open(meta_file, "r", newline="") as fh:
+        meta_rows = [row for row in csv.reader(fh)][1:]
+
+    with open(data_file, "r", newline="") as fh:
+        data_rows = [row for row in csv.reader(fh)]
+
+    header = data_rows[0]
+    first = header.index("Year")
+    minute_idx = header.index("date_time")
+    measure_names = [name.replace("_", " ") for name in header[first + 4 :]]
+
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow([row[0] for row in meta_rows])
+    writer.writerow([row[1] if len(row) > 1 else "" for row in meta_rows])
+    writer.writerow(time_components + measure_names)
+
+    for row in data_rows[1:]:
+        minute = int(row[minute_idx][14:16])
+        writer.writerow(row[first : first + 4] + [minute] + row[first + 4 :])
+
+    return out.getvalue()
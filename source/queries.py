@@ -1,3 +1,19 @@
+# value columns returned by select_nsr_rows, in order
+nsr_row_columns = [
+    "Clearsky_DHI",
+    "DHI",
+    "Clearsky_DNI",
+    "DNI",
+    "Clearsky_GHI",
+    "GHI",
+    "Temperature",
+    "Dew_Point",
+    "Relative_Humidity",
+    "Precipitable_Water",
+    "Pressure",
+    "Wind_Speed",
+]
+
 select_nsr_rows = """
 SELECT date_time,
 -- year, month, day, 
@@ -15,6 +31,7 @@ Wind_Speed
 from nsrdb
 where zipcode = :zipcode
 -- and not (month = 2 and day = 29)
+order by date_time
 ;
 """
 
@@ -22,6 +39,13 @@ select_column_names = """
 SELECT name FROM PRAGMA_TABLE_INFO(:table_name);
 """
 
+select_table_indexes = """
+select name, sql from sqlite_master
+where type = 'index'
+and tbl_name = :table_name
+and sql is not null;
+"""
+
 select_locale_data = """
 select city, county, state
 from geo_zipcodes
@@ -41,11 +65,35 @@ select_distinct_zips = """
 SELECT DISTINCT zipcode FROM nsrdb;
 """
 
+select_catalog_zips = """
+select zipcode from zip_catalog
+order by zipcode;
+"""
+
+select_zip_catalog = """
+select zipcode, first_year, last_year, year_count, years, row_count,
+first_date, last_date, city, county, state, updated
+from zip_catalog
+order by zipcode;
+"""
 
+
+# range form so the (zipcode, date_time) index is used
 select_zip_year = """
 select count(zipcode) from nsrdb
 where zipcode = :zipcode
-and substr(date_time, 1, 4) in (:year);
+and date_time >= printf('%04d-01-01', :year)
+and date_time < printf('%04d-01-01', :year + 1);
+"""
+
+delete_zip_year = """
+delete from nsrdb
+where zipcode = :zipcode
+and year = :year;
+"""
+
+select_gzc_count = """
+select count(*) from geo_zipcodes;
 """
 
 update_gzc_llltze = """
@@ -81,12 +129,17 @@ create table if not exists geo_zipcodes(
 """
 
 
+# bump when a migration is added to nsrdb_migrate.py
+nsrdb_schema_version = 2
+
+# date_time is ISO-8601 text, 'YYYY-MM-DD HH:MM:SS', so it sorts and
+# range-compares correctly and matches the composite index below
 create_table_nsrdb = """
 create table if not exists nsrdb(
 'id' INTEGER PRIMARY KEY AUTOINCREMENT,
 'location_id' INTEGER,
 'zipcode' CHAR(10),
-'date_time' CHAR(24),
+'date_time' TEXT,
 'year' INTEGER,
 'month' INTEGER,
 'day' INTEGER,
@@ -117,7 +170,7 @@ create table if not exists nsrdb(
 'id' INTEGER PRIMARY KEY AUTOINCREMENT,
 'location_id' INTEGER,
 'zipcode' CHAR(10),
-'date_time' CHAR(24),
+'date_time' TEXT,
 'Temperature' FLOAT,
 'Clearsky_DHI' FLOAT,
 'DHI' FLOAT,
@@ -134,6 +187,292 @@ create table if not exists nsrdb(
 'GHI_UV_nw' FLOAT);
 """
 
+create_table_download_manifest = """
+create table if not exists download_manifest(
+'zipcode' CHAR(10) NOT NULL,
+'year' INTEGER NOT NULL,
+'status' TEXT NOT NULL,
+'row_count' INTEGER,
+'checksum' CHAR(64),
+'updated' CHAR(24),
+PRIMARY KEY ('zipcode', 'year'));
+"""
+
+upsert_manifest = """
+insert into download_manifest(zipcode, year, status, row_count, checksum, updated)
+values (:zipcode, :year, :status, :row_count, :checksum, datetime('now'))
+on conflict(zipcode, year) do update set
+status = excluded.status,
+row_count = excluded.row_count,
+checksum = excluded.checksum,
+updated = excluded.updated;
+"""
+
+select_manifest = """
+select zipcode, year, status, row_count, checksum, updated
+from download_manifest
+order by zipcode, year;
+"""
+
+# back-fill the manifest from complete years loaded before it existed
+seed_manifest_from_nsrdb = """
+insert or ignore into download_manifest(zipcode, year, status, row_count, checksum, updated)
+select zipcode, year, 'done', count(*), null, datetime('now')
+from nsrdb
+group by zipcode, year
+having count(*) in (8760, 8784);
+"""
+
+# the zip-years seed_manifest_from_nsrdb would mark done, read-only
+select_complete_zip_years = """
+select zipcode, year, count(*)
+from nsrdb
+group by zipcode, year
+having count(*) in (8760, 8784);
+"""
+
+create_index_nsrdb = """
+create index if not exists idx_nsrdb_zipcode_date_time
+on nsrdb(zipcode, date_time);
+"""
+
+normalize_nsrdb_date_time = """
+update nsrdb
+set date_time = strftime('%Y-%m-%d %H:%M:%S', date_time)
+where strftime('%Y-%m-%d %H:%M:%S', date_time) is not null
+and date_time != strftime('%Y-%m-%d %H:%M:%S', date_time);
+"""
+
+select_table_exists = """
+select count(*) from sqlite_master
+where type = 'table'
+and name = :table_name;
+"""
+
+
+# one row per zip code in nsrdb: year coverage, row counts and locale,
+# maintained by zip_catalog.py so dropdowns never scan nsrdb
+create_table_zip_catalog = """
+create table if not exists zip_catalog(
+'zipcode' CHAR(10) PRIMARY KEY,
+'first_year' INTEGER,
+'last_year' INTEGER,
+'year_count' INTEGER,
+'years' TEXT,
+'row_count' INTEGER,
+'first_date' TEXT,
+'last_date' TEXT,
+'city' TEXT,
+'county' TEXT,
+'state' TEXT,
+'updated' CHAR(24));
+"""
+
+# one zip code, found through idx_nsrdb_zipcode_date_time
+refresh_zip_catalog = """
+insert or replace into zip_catalog(zipcode, first_year, last_year, year_count, years,
+row_count, first_date, last_date, city, county, state, updated)
+select y.zipcode, min(y.year), max(y.year), count(*), group_concat(y.year, ','),
+sum(y.row_count), min(y.first_date), max(y.last_date),
+g.city, g.county, g.state, datetime('now')
+from (
+    select zipcode, cast(substr(date_time, 1, 4) as integer) as year,
+    count(*) as row_count, min(date_time) as first_date, max(date_time) as last_date
+    from nsrdb
+    where zipcode = :zipcode
+    group by zipcode, substr(date_time, 1, 4)
+    order by zipcode, year
+) y
+left join (
+    select zipcode, min(city) as city, min(county) as county, min(state) as state
+    from geo_zipcodes
+    where zipcode = :zipcode
+    group by zipcode
+) g on g.zipcode = y.zipcode
+group by y.zipcode;
+"""
+
+# every zip code in one pass over nsrdb
+refresh_zip_catalog_all = """
+insert or replace into zip_catalog(zipcode, first_year, last_year, year_count, years,
+row_count, first_date, last_date, city, county, state, updated)
+select y.zipcode, min(y.year), max(y.year), count(*), group_concat(y.year, ','),
+sum(y.row_count), min(y.first_date), max(y.last_date),
+g.city, g.county, g.state, datetime('now')
+from (
+    select zipcode, cast(substr(date_time, 1, 4) as integer) as year,
+    count(*) as row_count, min(date_time) as first_date, max(date_time) as last_date
+    from nsrdb
+    group by zipcode, substr(date_time, 1, 4)
+    order by zipcode, year
+) y
+left join (
+    select zipcode, min(city) as city, min(county) as county, min(state) as state
+    from geo_zipcodes
+    group by zipcode
+) g on g.zipcode = y.zipcode
+group by y.zipcode;
+"""
+
+delete_zip_catalog = """
+delete from zip_catalog
+where zipcode = :zipcode
+and not exists (select 1 from nsrdb where nsrdb.zipcode = :zipcode);
+"""
+
+delete_zip_catalog_all = """
+delete from zip_catalog
+where not exists (select 1 from nsrdb where nsrdb.zipcode = zip_catalog.zipcode);
+"""
+
+
+# batch_forecast.py results, one run row per zipcode x feature x model
+create_table_forecast_runs = """
+create table if not exists forecast_runs(
+'zipcode' CHAR(10) NOT NULL,
+'feature' TEXT NOT NULL,
+'model' TEXT NOT NULL,
+'status' TEXT NOT NULL,
+'arima_order' TEXT,
+'seasonal_order' TEXT,
+'aic' FLOAT,
+'bic' FLOAT,
+'rmse' FLOAT,
+'n_obs' INTEGER,
+'fit_seconds' FLOAT,
+'error' TEXT,
+'updated' CHAR(24),
+PRIMARY KEY ('zipcode', 'feature', 'model'));
+"""
+
+upsert_forecast_run = """
+insert into forecast_runs(zipcode, feature, model, status, arima_order, seasonal_order,
+aic, bic, rmse, n_obs, fit_seconds, error, updated)
+values (:zipcode, :feature, :model, :status, :arima_order, :seasonal_order,
+:aic, :bic, :rmse, :n_obs, :fit_seconds, :error, datetime('now'))
+on conflict(zipcode, feature, model) do update set
+status = excluded.status,
+arima_order = excluded.arima_order,
+seasonal_order = excluded.seasonal_order,
+aic = excluded.aic,
+bic = excluded.bic,
+rmse = excluded.rmse,
+n_obs = excluded.n_obs,
+fit_seconds = excluded.fit_seconds,
+error = excluded.error,
+updated = excluded.updated;
+"""
+
+select_forecast_runs_done = """
+select zipcode, feature, model from forecast_runs
+where status = 'done';
+"""
+
+# kind: 'test_pred' (held-out months) or 'forecast' (past the last month)
+create_table_forecasts = """
+create table if not exists forecasts(
+'zipcode' CHAR(10) NOT NULL,
+'feature' TEXT NOT NULL,
+'model' TEXT NOT NULL,
+'kind' TEXT NOT NULL,
+'date_time' TEXT NOT NULL,
+'value' FLOAT,
+PRIMARY KEY ('zipcode', 'feature', 'model', 'kind', 'date_time'));
+"""
+
+delete_forecasts = """
+delete from forecasts
+where zipcode = :zipcode
+and feature = :feature
+and model = :model;
+"""
+
+
+# raw nsrdb_<zipcode>_<year>.csv files already aggregated into a monthly
+# database, see nsrdb_aggregate.py; a file is redone when size or mtime change
+create_table_aggregated_files = """
+create table if not exists aggregated_files(
+'path' TEXT PRIMARY KEY,
+'size' INTEGER NOT NULL,
+'mtime' FLOAT NOT NULL,
+'zipcode' CHAR(10),
+'year' INTEGER,
+'row_count' INTEGER,
+'updated' CHAR(24));
+"""
+
+select_aggregated_files = """
+select path, size, mtime from aggregated_files;
+"""
+
+upsert_aggregated_file = """
+insert into aggregated_files(path, size, mtime, zipcode, year, row_count, updated)
+values (:path, :size, :mtime, :zipcode, :year, :row_count, datetime('now'))
+on conflict(path) do update set
+size = excluded.size,
+mtime = excluded.mtime,
+zipcode = excluded.zipcode,
+year = excluded.year,
+row_count = excluded.row_count,
+updated = excluded.updated;
+"""
+
+# date_time range rather than substr() so idx_nsrdb_zipcode_date_time is used
+delete_nsrdb_zip_year = """
+delete from nsrdb
+where zipcode = :zipcode
+and date_time >= :start
+and date_time < :end;
+"""
+
+
+# zip-years of an hourly nsrdb table, see nsrdb_rollup.py
+select_nsrdb_zip_years = """
+select distinct zipcode, year from nsrdb
+order by zipcode, year;
+"""
+
+# rows of nsrdb or one of its rollup tables inside [:start, :end]; {table}
+# and the quoted {columns} are filled in by ts_tools after validation
+select_nsr_rows_window = """
+SELECT date_time, {columns}
+from {table}
+where zipcode = :zipcode
+and date_time >= :start
+and date_time <= :end
+order by date_time;
+"""
+
+select_zip_date_range = """
+select min(date_time), max(date_time) from nsrdb
+where zipcode = :zipcode;
+"""
+
+# rows and newest rowid of one zip code, both from idx_nsrdb_zipcode_date_time;
+# AUTOINCREMENT ids are never reused, so any reload of the zip code changes it
+select_zip_version = """
+select count(*), max(rowid) from nsrdb
+where zipcode = :zipcode;
+"""
+
+# one feature of many zip codes in a single round trip: :zipcodes is a JSON
+# array expanded by json_each (key = position in the array), {table} and the
+# quoted {column} come from ts_tools
+select_multi_zip_rows = """
+SELECT z.key, n.date_time, n.{column}
+from json_each(:zipcodes) z
+join {table} n on n.zipcode = z.value
+where n.date_time >= :start
+and n.date_time <= :end;
+"""
+
+select_multi_locale_data = """
+select zipcode, min(city), min(county), min(state)
+from geo_zipcodes
+where zipcode in (select value from json_each(:zipcodes))
+group by zipcode;
+"""
+
 
 # test query
 select_zipcode = """
@@ -1,16 +1,27 @@
 import glob
+import json
 import math
 import sqlite3
 import sys
+from contextlib import contextmanager
 from itertools import product
 
 import logzero
+import numpy as np
 import pandas as pd
+import yaml
 from logzero import logger
-from statsmodels.tsa.seasonal import seasonal_decompose
+from statsmodels.tsa.seasonal import DecomposeResult
 
 sys.path.append("../source")
+import data_cache
+import db_pool
+import npy_cache
+import nsrdb_dtypes
+import nsrdb_rollup
+import parquet_store
 import queries
+import zip_catalog
 
 
 # Connect to logzero log file
@@ -25,15 +36,76 @@ logzero.logfile(
 logger.info(f"ts_tools logger initialized")
 
 
+try:
+    with open("../source/config.yml", "r") as config_in:
+        cfg = yaml.load(config_in, Loader=yaml.SafeLoader)
+except:
+    logger.error(f"config file open failure.")
+    exit(1)
+
+storage_backend = cfg["storage"]["backend"]
+logger.info(f"storage backend: {storage_backend}")
+
+connection_pool = db_pool.create_pool(**cfg["connection_pool"])
+result_cache = data_cache.ResultCache(**cfg["result_cache"])
+npy_store = npy_cache.NpyCache(**cfg["npy_cache"]) if storage_backend == "npy" else None
+
+
+def get_data_signature(conn):
+    """database signature, plus the parquet dataset version with the parquet backend"""
+    signature = data_cache.get_db_signature(conn)
+    if storage_backend == "parquet":
+        root = parquet_store.get_dataset_root(cfg["storage"]["parquet_path"], signature[0])
+        signature += (parquet_store.get_dataset_version(root),)
+    return signature
+
+
 
 def get_db_connection(db_path, db_filename):
-    conn = sqlite3.connect(db_path + db_filename)
-    logger.info(f"Connection made: {conn}")
+    """pooled read-only connection, conn.close() returns it to the pool"""
+    conn = connection_pool.acquire(db_path + db_filename)
+    logger.info(f"Connection acquired: {conn}, pool: {connection_pool.stats()}")
     return conn
 
 
+@contextmanager
+def db_connection(db_path, db_filename):
+    conn = get_db_connection(db_path, db_filename)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def get_db_filename(conn):
+    """file name of the connection's main database"""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA database_list;")
+    files = {row[1]: row[2] for row in cursor.fetchall()}
+    return files["main"]
+
+
+def get_cache_stats():
+    """result cache, connection pool, npy cache and dtype plan counters for monitoring"""
+    stats = {
+        "result_cache": result_cache.stats(),
+        "connection_pool": connection_pool.stats(),
+        "dtype_plan": nsrdb_dtypes.stats(),
+    }
+    if npy_store is not None:
+        stats["npy_cache"] = npy_store.stats()
+    return stats
+
+
+@data_cache.cached(result_cache, get_data_signature)
 def get_db_zipcodes(conn):
+    """zip codes from the zip_catalog table, scanning nsrdb only for pre-catalog databases"""
     cursor = conn.cursor()
+    cursor.execute(queries.select_table_exists, {"table_name": "zip_catalog"})
+    if cursor.fetchone()[0]:
+        return zip_catalog.get_catalog_zips(conn)
+
+    logger.warning(f"no zip_catalog in {get_db_filename(conn)}, run nsrdb_migrate.py")
     cursor.execute(queries.select_distinct_zips)
     zipcodes = cursor.fetchall()
     zipcodes = [z[0] for z in zipcodes]
@@ -50,6 +122,7 @@ def get_column_names(conn, table_name):
     return names
 
 
+@data_cache.cached(result_cache, get_data_signature)
 def get_locale_data(conn, zipcode):
     """retrieve locale data from geo_zipcodes table of the database"""
     cursor = conn.cursor()
@@ -71,21 +144,362 @@ def get_db_files(db_path="./"):
     return tuple(sorted(db_files))
 
 
-def get_irr_data(conn, zipcode):
-    """retrieve irradiance data from database"""
-    params = {"zipcode": zipcode}
+def get_irr_data(conn, zipcode, resolution=None, start=None, end=None, columns=None):
+    """
+    input: sqlite3 connection, zip code, optional resolution ("daily",
+           "monthly", "yearly"), inclusive start/end bounds and feature list
+           (default: queries.nsr_row_columns)
+    functionality: npy backend reads of the nsrdb rows are sliced from the
+                   memory maps and skip the result cache, so the read-only
+                   pages stay shared and are never copied; every other read
+                   goes through read_irr_data
+    return: DataFrame indexed and sorted by date_time, compact dtypes
+            (see nsrdb_dtypes)
+    """
+    columns = list(columns or queries.nsr_row_columns)
+
+    if storage_backend == "npy" and set(columns) <= set(npy_store.columns):
+        if not resolution or get_resolutions(conn).get(resolution) == "nsrdb":
+            start = pd.Timestamp(start) if start is not None else None
+            end = pd.Timestamp(end) if end is not None else None
+            df = npy_store.read_irr_data(conn, zipcode, columns, start, end)
+            if df is not None:
+                return df
+
+    return read_irr_data(conn, zipcode, resolution, start, end, columns)
+
+
+@data_cache.cached(result_cache, get_data_signature)
+def read_irr_data(conn, zipcode, resolution=None, start=None, end=None, columns=None):
+    """
+    input: as get_irr_data
+    functionality: read from the configured storage backend, or from the
+                   rollup table of resolution when it exists; the window and
+                   the validated columns are pushed into the query
+    return: DataFrame indexed and sorted by date_time, compact dtypes
+    """
+    columns = list(columns or queries.nsr_row_columns)
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    available = get_resolutions(conn) if resolution else {}
+    if resolution in available and available[resolution] != "nsrdb":
+        return read_nsr_rows(conn, available[resolution], zipcode, start, end, columns)
+    if resolution in resolution_rules and resolution not in available and "hourly" in available:
+        # no rollup table: resample the hourly rows as they stream in
+        logger.info(f"no {resolution} rollup, resampling {zipcode} from nsrdb")
+        chunks = iter_irr_data(conn, zipcode, start=start, end=end, columns=columns)
+        frames = list(resample_stream(chunks, resolution_rules[resolution]))
+        if frames:
+            return nsrdb_dtypes.apply_plan(pd.concat(frames))
+        return read_nsr_rows(conn, "nsrdb", zipcode, start, end, columns)
+
+    if storage_backend == "parquet":
+        root = parquet_store.get_dataset_root(cfg["storage"]["parquet_path"], get_db_filename(conn))
+        if parquet_store.has_dataset(root):
+            columns = check_columns(conn, "nsrdb", columns)
+            df = parquet_store.read_irr_data(root, zipcode, columns, start=start, end=end)
+            return nsrdb_dtypes.apply_plan(df)
+        logger.warning(f"no parquet dataset at {root}, reading from SQLite")
+
+    return read_nsr_rows(conn, "nsrdb", zipcode, start, end, columns)
+
+
+# resolution: (table, nominal hours per row), finest first; the rollup
+# tables are maintained by nsrdb_rollup.py in hourly databases
+resolutions = {
+    "hourly": ("nsrdb", 1),
+    "daily": (nsrdb_rollup.rollup_levels["daily"]["table"], 24),
+    "monthly": (nsrdb_rollup.rollup_levels["monthly"]["table"], 730.5),
+    "yearly": (nsrdb_rollup.rollup_levels["yearly"]["table"], 8766),
+}
+
+
+# pandas rules giving the rollup tables' date_time labels
+resolution_rules = {
+    "daily": "D",
+    "monthly": pd.offsets.MonthEnd(),
+    "yearly": pd.offsets.YearEnd(),
+}
+
+
+def get_native_resolution(conn):
+    """resolution of the nsrdb table: hourly downloads, else the aggregated (monthly) database"""
+    return "hourly" if "hour" in get_column_names(conn, "nsrdb") else "monthly"
+
+
+def get_resolutions(conn):
+    """{resolution: table} available in the database, finest (nsrdb) first"""
+    native = get_native_resolution(conn)
+    names = list(resolutions)
+    available = {native: "nsrdb"}
+
+    cursor = conn.cursor()
+    for name in names[names.index(native) + 1 :]:
+        cursor.execute(queries.select_table_exists, {"table_name": resolutions[name][0]})
+        if cursor.fetchone()[0]:
+            available[name] = resolutions[name][0]
+
+    return available
+
+
+def select_resolution(available, hours, min_points):
+    """coarsest of the available resolutions with at least min_points rows in hours, else the finest"""
+    chosen = available[0]
+    for name in available:
+        if hours / resolutions[name][1] >= min_points:
+            chosen = name
+
+    return chosen
+
+
+def get_min_points(width_px=None):
+    """
+    rows wanted for a plot width_px pixels wide (None: not yet measured),
+    the width in 100 px steps so resizes do not fragment the result cache
+    """
+    width_px = width_px or cfg["resolution"]["default_width_px"]
+    width_px = max(100, 100 * round(width_px / 100))
+    return int(width_px * cfg["resolution"]["points_per_px"])
+
+
+def check_columns(conn, table, columns):
+    """columns checked against get_column_names before they go into SQL"""
+    names = {name.lower() for name in get_column_names(conn, table)}
+    unknown = [col for col in columns if col.lower() not in names or col.lower() == "date_time"]
+    if unknown:
+        raise ValueError(f"columns not in {table}: {unknown}")
+    return list(columns)
+
+
+def get_window_sql(conn, table, columns):
+    columns = check_columns(conn, table, columns or queries.nsr_row_columns)
+    return queries.select_nsr_rows_window.format(
+        table=table, columns=", ".join(f'"{col}"' for col in columns)
+    )
+
+
+def get_window_params(zipcode, start=None, end=None):
+    """select_nsr_rows_window parameters, open ended where start/end are None"""
+    return {"zipcode": str(zipcode), **get_bounds(start, end)}
+
 
+def get_bounds(start=None, end=None):
+    return {
+        "start": start.strftime("%Y-%m-%d %H:%M:%S") if start is not None else "0000",
+        "end": end.strftime("%Y-%m-%d %H:%M:%S") if end is not None else "9999",
+    }
+
+
+def read_nsr_rows(conn, table, zipcode, start=None, end=None, columns=None):
+    """columns of one zip code from nsrdb or a rollup table, optionally windowed, compact dtypes"""
     df = pd.read_sql(
-        queries.select_nsr_rows,
+        get_window_sql(conn, table, columns),
         conn,
-        params=params,
+        params=get_window_params(zipcode, start, end),
         index_col="date_time",
         parse_dates=["date_time"],
     )
+    return nsrdb_dtypes.apply_plan(df)
+
+
+def iter_irr_data(conn, zipcode, chunk_rows=50000, table="nsrdb", start=None, end=None, columns=None):
+    """
+    input: sqlite3 connection, zip code, rows per chunk, nsrdb or a rollup
+           table, optional start/end Timestamps and feature list
+    functionality: stream the columns in date_time order straight off
+                   idx_nsrdb_zipcode_date_time (no sort), cursor.fetchmany
+                   keeps at most one chunk of rows in memory
+    yield: float32 DataFrames of up to chunk_rows rows with a DatetimeIndex
+    """
+    cursor = conn.cursor()
+    cursor.execute(get_window_sql(conn, table, columns), get_window_params(zipcode, start, end))
+    columns = [item[0] for item in cursor.description]
+
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            break
+
+        df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        df.index = pd.to_datetime(df.pop(columns[0]), format="%Y-%m-%d %H:%M:%S")
+        yield df.astype(nsrdb_dtypes.measure_dtype)
+
+
+def resample_stream(chunks, rule, how="mean"):
+    """
+    input: iterable of DataFrames in index order (see iter_irr_data), pandas
+           resample rule or offset, "mean" | "sum"
+    functionality: resample chunk by chunk from running per-bin sums and
+                   counts, carrying only the still open last bin forward
+    yield: DataFrames of the bins completed so far (float64)
+    """
+    open_sums = open_counts = None
+
+    for chunk in chunks:
+        resampler = chunk.astype("float64").resample(rule)
+        sums, counts = resampler.sum(), resampler.count()
+        if open_sums is not None:
+            sums = sums.add(open_sums, fill_value=0)
+            counts = counts.add(open_counts, fill_value=0)
+
+        open_sums, open_counts = sums.iloc[-1:], counts.iloc[-1:]
+        if len(sums) > 1:
+            yield get_bins(sums.iloc[:-1], counts.iloc[:-1], how)
+
+    if open_sums is not None:
+        yield get_bins(open_sums, open_counts, how)
+
+
+def get_bins(sums, counts, how):
+    """resample_stream output; bins without observations are NaN"""
+    if how == "sum":
+        return sums.where(counts > 0)
+    return sums.where(counts > 0) / counts.where(counts > 0)
+
+
+@data_cache.cached(result_cache, get_data_signature)
+def get_irr_view(conn, zipcode, x_range=None, min_points=None, columns=None):
+    """
+    input: sqlite3 connection, zip code, (start, end) Timestamps of the visible
+           window (None or "reset": the whole series), minimum rows wanted
+           (default: get_min_points() of the default plot width), features
+           plotted (default: queries.nsr_row_columns)
+    functionality: read only the window, at the coarsest resolution that still
+                   gives min_points rows, so zoomed-out plots read rollups
+    return: (DataFrame, resolution name)
+    """
+    if min_points is None:
+        min_points = get_min_points()
+
+    available = get_resolutions(conn)
+    native = list(available)[0]
+
+    windowed = bool(x_range) and x_range != "reset"
+    if windowed:
+        start, end = pd.Timestamp(x_range[0]), pd.Timestamp(x_range[1])
+    else:
+        cursor = conn.cursor()
+        cursor.execute(queries.select_zip_date_range, {"zipcode": zipcode})
+        first, last = cursor.fetchone()
+        if first is None:
+            return get_irr_data(conn, zipcode, columns=columns), native
+        start, end = pd.Timestamp(first), pd.Timestamp(last)
+
+    hours = (end - start) / pd.Timedelta(hours=1)
+    resolution = select_resolution(list(available), hours, min_points)
+
+    if resolution == native and not windowed:
+        df = get_irr_data(conn, zipcode, columns=columns)
+    else:
+        # one row either side keeps lines running to the window edges
+        pad = pd.Timedelta(hours=resolutions[resolution][1])
+        df = read_nsr_rows(conn, available[resolution], zipcode, start - pad, end + pad, columns)
+
+    logger.info(f"irr view {zipcode} {x_range}: {resolution}, {len(df)} rows")
+    return df, resolution
+
+
+@data_cache.cached(result_cache, get_data_signature)
+def get_multi_zip_data(conn, zipcodes, feature, resolution=None, start=None, end=None):
+    """
+    input: sqlite3 connection, list of zip codes, one feature, optional
+           resolution ("hourly", "daily", "monthly", "yearly", default: the
+           database's own) and inclusive start/end bounds
+    functionality: fetch the feature of every zip code with one query (the
+                   zip codes go in as a single JSON array) and scatter the
+                   long rows into a time x zip code matrix with numpy; a
+                   resolution finer than the database's own is clamped to it
+    return: (DataFrame indexed by date_time, one float32 column per zip code
+            in the order given, NaN where a zip code has no row,
+            resolution name actually used)
+    """
+    zipcodes = [str(zipcode) for zipcode in dict.fromkeys(zipcodes)]
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    available = get_resolutions(conn)
+    native = list(available)[0]
+    names = list(resolutions)
+    if resolution is None or names.index(resolution) < names.index(native):
+        resolution = native
+    table = available.get(resolution, "nsrdb")
+    column = check_columns(conn, table, [feature])[0]
+
+    cursor = conn.cursor()
+    cursor.execute(
+        queries.select_multi_zip_rows.format(table=table, column=f'"{column}"'),
+        {"zipcodes": json.dumps(zipcodes), **get_bounds(start, end)},
+    )
+    rows = pd.DataFrame.from_records(
+        cursor.fetchall(), columns=["col", "date_time", "value"], coerce_float=True
+    )
+
+    # hash the date_time text, then sort only the distinct values (ISO text
+    # sorts chronologically) to get each row's matrix row
+    codes, times = pd.factorize(rows["date_time"])
+    order = np.argsort(times)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+
+    matrix = np.full((len(times), len(zipcodes)), np.nan, dtype=nsrdb_dtypes.measure_dtype)
+    matrix[rank[codes], rows["col"].to_numpy(dtype=np.int64)] = rows["value"].to_numpy(dtype=np.float64)
+
+    times = pd.to_datetime(np.asarray(times)[order], format="%Y-%m-%d %H:%M:%S")
+    index = pd.DatetimeIndex(times, name="date_time")
+    df = pd.DataFrame(matrix, index=index, columns=zipcodes)
+
+    if table == "nsrdb" and resolution != native:
+        # no rollup table for a coarser resolution: resample the native rows
+        df = df.resample(resolution_rules[resolution]).mean().astype(nsrdb_dtypes.measure_dtype)
+
+    logger.info(f"multi zip {feature} ({resolution}): {len(zipcodes)} zip codes, {len(rows)} rows")
+    return df, resolution
+
+
+@data_cache.cached(result_cache, get_data_signature)
+def get_multi_locale_data(conn, zipcodes):
+    """{zipcode: [city, county, state]} of many zip codes in one query"""
+    cursor = conn.cursor()
+    cursor.execute(queries.select_multi_locale_data, {"zipcodes": json.dumps([str(z) for z in zipcodes])})
+    return {row[0]: list(row[1:]) for row in cursor.fetchall()}
 
-    df.sort_index(axis=0, inplace=True)
 
-    return df
+def get_bin_edges(values, bins="fd", max_bins=100):
+    """fixed or Freedman-Diaconis bin edges, fd falls back to max_bins when degenerate"""
+    if bins != "fd":
+        return np.histogram_bin_edges(values, bins=int(bins))
+
+    edges = np.histogram_bin_edges(values, bins="fd")
+    # zero IQR (e.g. night-time zeros) gives one bin, heavy tails too many
+    if not 2 < len(edges) <= max_bins + 1:
+        edges = np.histogram_bin_edges(values, bins=max_bins)
+    return edges
+
+
+def get_histogram(values, bins="fd", max_bins=100):
+    """
+    input: feature values, bin rule
+    functionality: bin one feature server-side with NumPy, NaN ignored
+    return: (counts, bin edges) arrays
+    """
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    edges = get_bin_edges(values, bins, max_bins)
+    counts, edges = np.histogram(values, bins=edges)
+    return counts, edges
+
+
+@data_cache.cached(result_cache, get_data_signature)
+def get_histograms(conn, zipcode, features, bins="fd", max_bins=100):
+    """
+    {feature: (counts, bin edges)} for plot_tools.plot_histograms, binned from
+    one read of just the requested columns
+    """
+    df = get_irr_data(conn, zipcode, columns=list(features))
+    return {feature: get_histogram(df[feature].to_numpy(), bins, max_bins) for feature in features}
 
 
 def get_plots_layout(num_columns=1, num_items=1):
@@ -93,15 +507,64 @@ def get_plots_layout(num_columns=1, num_items=1):
     return {"rows": (math.ceil(num_items / num_columns)), "columns": num_columns}
 
 
+def decompose_frame(df, period=12):
+    """
+    input: DataFrame of numeric columns without missing values, seasonal period
+    functionality: additive decomposition of every column in one NumPy pass,
+                   same centered moving average and seasonal means as
+                   statsmodels seasonal_decompose(model="additive")
+    return: dict of column -> statsmodels DecomposeResult
+    """
+    x = df.to_numpy(dtype=np.float64)
+    nobs, ncols = x.shape
+    if np.isnan(x).any():
+        raise ValueError("decomposition does not handle missing values")
+    if nobs < 2 * period:
+        raise ValueError(f"decomposition needs 2 complete cycles, {nobs} observations for period {period}")
+
+    # centered moving average from cumulative sums; an even period uses a
+    # period + 1 window with half weight on both end points
+    half = period // 2
+    csum = np.vstack([np.zeros((1, ncols)), np.cumsum(x, axis=0)])
+    window = csum[2 * half + 1 :] - csum[: nobs - 2 * half]
+    if period % 2 == 0:
+        window -= 0.5 * (x[: nobs - 2 * half] + x[2 * half :])
+
+    trend = np.full_like(x, np.nan)
+    trend[half : nobs - half] = window / period
+
+    # mean of each position in the cycle, centered on zero
+    detrended = x - trend
+    n_cycles = -(-nobs // period)
+    padded = np.full((n_cycles * period, ncols), np.nan)
+    padded[:nobs] = detrended
+    period_averages = np.nanmean(padded.reshape(n_cycles, period, ncols), axis=0)
+    period_averages -= period_averages.mean(axis=0)
+
+    seasonal = np.tile(period_averages, (n_cycles, 1))[:nobs]
+    resid = detrended - seasonal
+
+    decomps = {}
+    for idx, col in enumerate(df.columns):
+        decomps[col] = DecomposeResult(
+            observed=df[col],
+            seasonal=pd.Series(seasonal[:, idx], index=df.index, name="seasonal"),
+            trend=pd.Series(trend[:, idx], index=df.index, name="trend"),
+            resid=pd.Series(resid[:, idx], index=df.index, name="resid"),
+        )
+
+    return decomps
+
+
 def get_data_decomps(df, period=12):
     """data decomposition"""
-    decomps = {}
-    cols = df.columns.tolist()
+    return decompose_frame(df, period=period)
 
-    for col in cols:
-        decomps.update({col: seasonal_decompose(df[col], model="additive", period=period)})
 
-    return decomps
+@data_cache.cached(result_cache, get_data_signature)
+def get_zip_decomps(conn, zipcode, period=12, resolution=None):
+    """decompositions of every column of a zip code's data"""
+    return decompose_frame(get_irr_data(conn, zipcode, resolution=resolution), period=period)
 
 
 def get_train_test(df, test_len_yrs=1):
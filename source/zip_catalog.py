@@ -0,0 +1,47 @@
+# per-database catalog of the zip codes in nsrdb (year coverage, row counts,
+# city/county/state), kept current by nsrdb_download.py and the aggregator
+# so the dashboard's zip code dropdowns read one small table
+#
+# rebuild the catalog of existing databases:
+#   python nsrdb_migrate.py   (schema v2 builds it)
+
+from logzero import logger
+
+import queries
+
+
+def create_catalog(conn):
+    cursor = conn.cursor()
+    cursor.execute(queries.create_table_zip_catalog)
+    # the locale join needs geo_zipcodes even in databases without one
+    cursor.execute(queries.create_table_geo_zipcodes)
+    conn.commit()
+
+
+def refresh(conn, zipcodes=None):
+    """
+    input: sqlite3 connection, iterable of zip codes (None: every zip code)
+    functionality: recompute the catalog rows of the given zip codes from
+                   nsrdb and drop rows whose zip code has no data left
+    return: None
+    """
+    create_catalog(conn)
+    cursor = conn.cursor()
+
+    if zipcodes is None:
+        cursor.execute(queries.refresh_zip_catalog_all)
+        cursor.execute(queries.delete_zip_catalog_all)
+    else:
+        # separate single zip code statements so each is an index SEARCH
+        for zipcode in zipcodes:
+            cursor.execute(queries.refresh_zip_catalog, {"zipcode": zipcode})
+            cursor.execute(queries.delete_zip_catalog, {"zipcode": zipcode})
+    conn.commit()
+
+    logger.info(f"zip catalog refreshed: {'all' if zipcodes is None else len(zipcodes)} zip codes")
+
+
+def get_catalog_zips(conn):
+    cursor = conn.cursor()
+    cursor.execute(queries.select_catalog_zips)
+    return [row[0] for row in cursor.fetchall()]